@@ -7,12 +7,18 @@ import cv2
 import numpy as np
 
 import occ_grid
+from food_index import FoodIndex
+from renderer import ArenaRenderer
 
 
-class Arena:
-    def __init__(self, occ_grid, x_sz=139.5, y_sz=75.5):
+class Arena(object):
+    def __init__(self, occ_grid, x_sz=139.5, y_sz=75.5, pyramid=None):
         self.grid = occ_grid
 
+        # the grid followed by successively halved copies in which a cell is
+        # free only if everything under it is free
+        self.pyramid = pyramid if pyramid is not None else [occ_grid]
+
         self.robot_x = 67
         self.robot_y = 15
         self.robot_angle = 90
@@ -28,17 +34,58 @@ class Arena:
         self.x_sc = self.x_sz / float(wd)
         self.y_sc = self.y_sz / float(ht)
 
-        self.pf_robot_x = 67
-        self.pf_robot_y = 15
+        # the particle filter's (x, y) estimate, replaced whole so a reader
+        # on another thread always gets both halves from the same step
+        self.pf_estimate = (67, 15)
 
         # display scale
         self.scale = 16
         self.particles = []
-        self.food = []
+        self.food_index = FoodIndex(cell_size=self.FOOD_RADIUS)
+        self.renderers = {}
 
         # life_size = occ_grid.make_occ_grid('arena_16_small.bmp', 140, 76, thresh=.5)
         # self.life_size_grid = life_size[::-1]
 
+    @property
+    def pf_robot_x(self):
+        return self.pf_estimate[0]
+
+    @pf_robot_x.setter
+    def pf_robot_x(self, x):
+        self.pf_estimate = (x, self.pf_estimate[1])
+
+    @property
+    def pf_robot_y(self):
+        return self.pf_estimate[1]
+
+    @pf_robot_y.setter
+    def pf_robot_y(self, y):
+        self.pf_estimate = (self.pf_estimate[0], y)
+
+    # food marked closer than this (cm) to an earlier mark replaces it
+    FOOD_RADIUS = 20.
+
+    # rays cast together; bounds the temporaries however many are asked for
+    RAY_CHUNK = 8192
+
+    @property
+    def food(self):
+        """ Food positions, most recently marked first """
+        return self.food_index.positions()
+
+    @food.setter
+    def food(self, positions):
+        self.food_index.clear()
+        for x, y in reversed(positions):
+            self.food_index.add(x, y)
+
+    def nearest_food(self, x=None, y=None):
+        """ The food closest to (x, y), by default the robot's position """
+        if x is None:
+            x, y = self.robot_x, self.robot_y
+        return self.food_index.nearest(x, y)
+
     BLUE = (255, 0, 0)
     RED = (0, 0, 255)
     GREEN = (0, 255, 0)
@@ -56,51 +103,112 @@ class Arena:
         return (int(coord[0] / self.x_sc),
                 int((coord[1]) / self.y_sc))
 
+    def cm_to_grid_array(self, xs, ys, out=None):
+        """ Vectorized cm_to_grid for arrays of coordinates, optionally into
+        a pair of preallocated integer arrays """
+        if out is None:
+            return ((np.asarray(xs) / self.x_sc).astype(int),
+                    (np.asarray(ys) / self.y_sc).astype(int))
+
+        grid_x, grid_y = out
+        np.divide(xs, self.x_sc, out=grid_x, casting='unsafe')
+        np.divide(ys, self.y_sc, out=grid_y, casting='unsafe')
+        return grid_x, grid_y
+
     def distance_to_collision(self, x, y, angle):
 
         rad = angle * np.pi / 180
+        ht, wd = self.grid.shape[0:2]
 
         for i in range(1, 1000):
             col_x = int(np.round(x + i * np.cos(rad)))
             col_y = int(np.round(y + i * np.sin(rad)))
 
-            if col_x >= len(self.grid) or col_y >= len(self.grid[0]) or col_x < 0 or col_y < 0:
+            if col_x >= wd or col_y >= ht or col_x < 0 or col_y < 0:
                 return i
 
-            if self.grid[col_x][col_y] == 0:
+            if self.grid[col_y][col_x] == 0:
                 return i
 
         raise Exception("no collision detected: x:{} y:{} angle:{}")
 
-    def get_robot_in_grid(self):
-        return self.cm_to_grid((self.robot_x, self.robot_y))
+    def distances_to_collision(self, xs, ys, angles, max_range=999, out=None):
+        """ Casts one ray per (x, y, angle) in grid coordinates.
+
+        Matches distance_to_collision for every ray that hits within
+        max_range steps; rays that are still travelling after max_range
+        steps get max_range + 1. With out (a contiguous array of the rays'
+        shape) given, the distances go there.
+        """
+        xs = np.asarray(xs)
+        distances = np.empty(xs.shape, dtype=int) if out is None else out
+
+        xs, ys, angles = xs.ravel(), np.asarray(ys).ravel(), np.asarray(angles).ravel()
+        flat = distances.reshape(-1)
+        for start in range(0, xs.size, self.RAY_CHUNK):
+            chunk = slice(start, start + self.RAY_CHUNK)
+            flat[chunk] = self._cast_rays(xs[chunk], ys[chunk], angles[chunk], max_range)
+
+        return distances
+
+    def _cast_rays(self, xs, ys, angles, max_range):
+        xs = np.asarray(xs, dtype=float)
+        ys = np.asarray(ys, dtype=float)
+        rad = np.asarray(angles, dtype=float) * np.pi / 180
+        cos = np.cos(rad)
+        sin = np.sin(rad)
 
-    def show(self, scale=5, wait_time=200):
         ht, wd = self.grid.shape[0:2]
-        img = np.zeros([scale * ht, scale * wd, 3], np.uint8)
-        for y in xrange(ht):
-            for x in xrange(wd):
-                img[y*scale:(y+1)*scale, x*scale:(x+1)*scale, :] = self.grid[ht-y-1, x]
+        distances = np.empty(xs.shape, dtype=int)
+        distances.fill(max_range + 1)
+
+        # indexes of rays that have not hit anything yet
+        active = np.arange(xs.size)
+
+        for i in range(1, max_range + 1):
+            col_x = np.round(xs + i * cos).astype(int)
+            col_y = np.round(ys + i * sin).astype(int)
+
+            hit = (col_x >= wd) | (col_y >= ht) | (col_x < 0) | (col_y < 0)
+            inside = ~hit
+            hit[inside] = self.grid[col_y[inside], col_x[inside]] == 0
 
-        for food_pos in self.food:
-            coords = self.cm_to_img(food_pos, scale=scale)
-            cv2.circle(img, coords, scale, self.PURPLE, -1)
+            distances[active[hit]] = i
 
-        for particle_pos in self.particles:
-            coords = self.cm_to_img(particle_pos, scale=scale)
-            cv2.circle(img, coords, scale/2, self.RED, -1)
+            if hit.all():
+                break
 
-        coord = self.cm_to_img((self.robot_x, self.robot_y), scale=scale)
-        pf_coord = self.cm_to_img((self.pf_robot_x, self.pf_robot_y), scale=scale)
+            keep = ~hit
+            active = active[keep]
+            xs, ys, cos, sin = xs[keep], ys[keep], cos[keep], sin[keep]
 
-        cv2.circle(img, coord, scale * 3 / 2, self.GREEN, -1)
-        cv2.circle(img, pf_coord, scale * 3 / 2, self.BLUE, -1)
-        home_coord = self.cm_to_img((self.home_x, self.home_y), scale=scale)
-        cv2.circle(img, home_coord, scale * 5, self.BLACK, 1)
+        return distances
 
-        cv2.imshow('Arena', img)
+    def sample_free(self, count, level=-1, random=np.random):
+        """ count (x, y) positions in cm, uniform over the free cells of a
+        pyramid level; the coarsest by default """
+        grid = self.pyramid[level]
+        ht, wd = grid.shape[0:2]
+        free_y, free_x = np.nonzero(grid)
+
+        cells = random.randint(0, len(free_x), count)
+        xs = (free_x[cells] + random.random_sample(count)) * self.x_sz / wd
+        ys = (free_y[cells] + random.random_sample(count)) * self.y_sz / ht
+        return xs, ys
+
+    def get_robot_in_grid(self):
+        return self.cm_to_grid((self.robot_x, self.robot_y))
+
+    def show(self, scale=5, wait_time=200):
+        cv2.imshow('Arena', self.render(scale))
         cv2.waitKey(1)
 
+    def render(self, scale=5):
+        renderer = self.renderers.get(scale)
+        if renderer is None:
+            renderer = self.renderers[scale] = ArenaRenderer(self, scale)
+        return renderer.render()
+
     def add_angle(self, angle):
         self.robot_angle = (self.robot_angle + angle) % 360
 
@@ -110,21 +218,15 @@ class Arena:
 
     def mark_food(self):
         # Avoid duplicate food locations
-        for food_loc in self.food:
-            if np.sqrt((food_loc[0] - self.robot_x) *
-                       (food_loc[0] - self.robot_x) +
-                       (food_loc[1] - self.robot_y) *
-                       (food_loc[1] - self.robot_y)) < 20:
-                self.food.remove(food_loc)
-        self.food.insert(0, (self.robot_x, self.robot_y))
+        self.food_index.add(self.robot_x, self.robot_y, radius=self.FOOD_RADIUS)
 
 
 def build_arena(img):
     img = cv2.imread(img)
 
     # (56, 30) corresponds roughly to 2.5 x 2.5cm blocks
-    og = occ_grid.make_occ_grid(img, 140, 76, thresh=.5)
-    arena = Arena(og[::-1])
+    pyramid = occ_grid.make_occ_grid_pyramid(img, 140, 76, levels=3, thresh=.5)
+    arena = Arena(pyramid[0][::-1], pyramid=[level[::-1] for level in pyramid])
 
     # arena.particles.append((5, 5))
 
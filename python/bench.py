@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+
+# Benchmarks for the localization and sensing hot paths.
+# Every case runs in its own forked process so its peak memory can be
+# reported on its own. Runs headless: no serial port, no display.
+#
+#     python bench.py --out before.json
+#     python bench.py --out after.json
+#     python bench.py --compare before.json after.json
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import time
+import timeit
+
+import cv2
+import numpy as np
+
+import occ_grid
+from arena import build_arena
+from calibration import IR_CALIBRATION
+from particle_filter import ParticleFilter
+from util import normalize_sensor_readings
+
+ARENA_IMAGE = 'arena_16_small.bmp'
+
+PARTICLE_COUNTS = (100, 1000, 10000, 100000)
+GRID_RESOLUTIONS = ((56, 30), (140, 76), (280, 152), (512, 279))
+SCALAR_RAY_LIMIT = 1000  # the scalar ray-caster is too slow for larger sets
+
+PERCENTILES = (50, 90, 99)
+
+
+def _spread_particles(arena, particles, seed=0):
+    random = np.random.RandomState(seed)
+    particles[:, 0] = random.uniform(0, arena.x_sz, len(particles))
+    particles[:, 1] = random.uniform(0, arena.y_sz, len(particles))
+    particles[:, 2] = random.uniform(0, 360, len(particles))
+
+
+def _random_rays(arena, count, seed=0):
+    random = np.random.RandomState(seed)
+    ht, wd = arena.grid.shape[0:2]
+    return random.randint(0, wd, count), random.randint(0, ht, count), random.uniform(0, 360, count)
+
+
+def setup_pf_go(particles, dtype='float64'):
+    arena = build_arena(ARENA_IMAGE)
+    pf = ParticleFilter(particles, arena, dtype=dtype)
+    _spread_particles(arena, pf.particles)
+    readings = [5.5, 5.5, 3., 3., 5.5, 5.5, 1., 5.5]
+    return lambda: pf.go((62, 62), readings)
+
+
+def setup_distance_to_collision(rays):
+    arena = build_arena(ARENA_IMAGE)
+    xs, ys, angles = _random_rays(arena, rays)
+
+    def run():
+        for x, y, angle in zip(xs, ys, angles):
+            arena.distance_to_collision(x, y, angle)
+    return run
+
+
+def setup_distances_to_collision(rays):
+    arena = build_arena(ARENA_IMAGE)
+    xs, ys, angles = _random_rays(arena, rays)
+    return lambda: arena.distances_to_collision(xs, ys, angles, max_range=ParticleFilter.SENSOR_MAX_RANGE)
+
+
+def setup_make_occ_grid(n_x, n_y):
+    img = cv2.imread(ARENA_IMAGE)
+    return lambda: occ_grid.make_occ_grid(img.copy(), n_x, n_y, thresh=.5)
+
+
+def setup_arena_render(particles):
+    arena = build_arena(ARENA_IMAGE)
+    points = np.empty((particles, 3))
+    _spread_particles(arena, points)
+    arena.particles = points
+    arena.food = [(20, 20), (100, 60)]
+    return lambda: arena.render()
+
+
+def _random_readings(vectors):
+    return np.random.RandomState(0).randint(0, 1024, (vectors, 8))
+
+
+def setup_normalize_sensor_readings():
+    reading = list(_random_readings(1)[0])
+    return lambda: normalize_sensor_readings(reading)
+
+
+def setup_calibration_to_cm(vectors):
+    readings = _random_readings(vectors)
+    return lambda: IR_CALIBRATION.to_cm(readings)
+
+
+CASES = (
+    [('ParticleFilter.go', setup_pf_go, dict(particles=n)) for n in PARTICLE_COUNTS] +
+    [('ParticleFilter.go', setup_pf_go, dict(particles=n, dtype='float32')) for n in PARTICLE_COUNTS] +
+    [('Arena.distance_to_collision', setup_distance_to_collision, dict(rays=n))
+     for n in PARTICLE_COUNTS if n <= SCALAR_RAY_LIMIT] +
+    [('Arena.distances_to_collision', setup_distances_to_collision, dict(rays=n)) for n in PARTICLE_COUNTS] +
+    [('occ_grid.make_occ_grid', setup_make_occ_grid, dict(n_x=n_x, n_y=n_y)) for n_x, n_y in GRID_RESOLUTIONS] +
+    [('Arena.render', setup_arena_render, dict(particles=n)) for n in PARTICLE_COUNTS] +
+    [('normalize_sensor_readings', setup_normalize_sensor_readings, dict())] +
+    [('IR_CALIBRATION.to_cm', setup_calibration_to_cm, dict(vectors=n)) for n in (1, 1000, 100000)]
+)
+
+
+def case_key(name, params):
+    return name + '(' + ', '.join('{}={}'.format(k, params[k]) for k in sorted(params)) + ')'
+
+
+def _run_case(setup, params, repeat, budget, queue):
+    # normalize_sensor_readings and friends print on every call
+    sys.stdout = open(os.devnull, 'w')
+
+    start_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    run = setup(**params)
+    run()  # warm up
+
+    times = []
+    deadline = time.time() + budget
+    while len(times) < repeat and (len(times) < 3 or time.time() < deadline):
+        start = timeit.default_timer()
+        run()
+        times.append(timeit.default_timer() - start)
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put(dict(times=times, peak_rss_kb=peak_rss, peak_rss_delta_kb=peak_rss - start_rss))
+
+
+def run_case(name, setup, params, repeat, budget):
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_run_case, args=(setup, params, repeat, budget, queue))
+    process.start()
+    raw = queue.get()
+    process.join()
+
+    times = np.array(raw['times']) * 1000
+    result = dict(name=name, params=params, runs=len(times),
+                  mean_ms=float(times.mean()), max_ms=float(times.max()),
+                  peak_rss_kb=raw['peak_rss_kb'], peak_rss_delta_kb=raw['peak_rss_delta_kb'])
+    for p in PERCENTILES:
+        result['p{}_ms'.format(p)] = float(np.percentile(times, p))
+    return result
+
+
+def print_header():
+    print '{:<60} {:>6} {:>10} {:>10} {:>10} {:>10}'.format('case', 'runs', 'p50 ms', 'p90 ms', 'p99 ms',
+                                                            'peak +KiB')
+
+
+def print_result(r):
+    print '{:<60} {:>6} {:>10.3f} {:>10.3f} {:>10.3f} {:>10}'.format(
+        case_key(r['name'], r['params']), r['runs'], r['p50_ms'], r['p90_ms'], r['p99_ms'],
+        r['peak_rss_delta_kb'])
+
+
+def compare(before_path, after_path):
+    with open(before_path) as f:
+        before = dict((case_key(r['name'], r['params']), r) for r in json.load(f)['results'])
+    with open(after_path) as f:
+        after = json.load(f)['results']
+
+    print '{:<60} {:>10} {:>10} {:>8} {:>12}'.format('case', 'before ms', 'after ms', 'speedup', 'peak +KiB')
+    for r in after:
+        key = case_key(r['name'], r['params'])
+        if key not in before:
+            print '{:<60} {:>10} {:>10.3f}'.format(key, '-', r['p50_ms'])
+            continue
+
+        b = before[key]
+        print '{:<60} {:>10.3f} {:>10.3f} {:>7.2f}x {:>12}'.format(
+            key, b['p50_ms'], r['p50_ms'], b['p50_ms'] / r['p50_ms'],
+            '{} -> {}'.format(b['peak_rss_delta_kb'], r['peak_rss_delta_kb']))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Benchmark the localization and sensing hot paths')
+    parser.add_argument('--out', help='write results to this JSON file')
+    parser.add_argument('--filter', default='', help='only run cases whose name contains this')
+    parser.add_argument('--repeat', type=int, default=50, help='maximum timed runs per case')
+    parser.add_argument('--budget', type=float, default=5., help='seconds per case after 3 runs')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='diff two result files')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    print_header()
+
+    results = []
+    for name, setup, params in CASES:
+        if args.filter in name:
+            results.append(run_case(name, setup, params, args.repeat, args.budget))
+            print_result(results[-1])
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(dict(created=time.strftime('%Y-%m-%dT%H:%M:%S'),
+                           python=platform.python_version(),
+                           numpy=np.__version__,
+                           machine=platform.machine(),
+                           results=results), f, indent=2, sort_keys=True)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,108 @@
+# Converts raw Khepera IR readings to distances in cm.
+# The per-sensor inverse curves are evaluated with NumPy on whole reading
+# vectors (or batches of them) instead of being re-parsed by sympy per call.
+# Fitted curves are loaded from the file fit_calibration.py writes.
+
+import os
+
+import numpy as np
+
+# Each sensor's distance is the real root of a cubic fit of reading against
+# distance, written in closed form as
+#     z = a*y + ((2a*y - b)**2 + c)**0.5 / 2 - b/2
+#     cm = -z**(1/3) / 3 + d + e / z**(1/3)
+# with y the raw reading. Rows are (a, b, c, d, e) for sensors 0-7.
+LEGACY_COEFFICIENTS = np.array([
+    (1.05489353389334, 228.025473190865, 52.7683910644765, 4.09092921794621, 0.787619933592481),
+    (2.49820499344915, 654.05464368429, -4552.17135227556, 5.71415970253472, -3.48015255483768),
+    (0.80681308830121, 277.667879948999, 89.5260629436753, 3.60021913441904, 0.939381299239288),
+    (0.813221297446366, 244.209046550634, 14.077287454097, 3.69062550099722, 0.507027763879187),
+    (0.92945760984812, 199.626931022404, 8.67972681703231, 3.94216249213977, 0.431546336056804),
+    (1.46838405965773, 439.144916355782, 31.4324338358655, 4.52204280140124, 0.662701700283462),
+    (1.18540633094789, 624.313273969406, 196.584928623404, 3.95884737527623, 1.22098076214061),
+    (0.606425414166098, 164.119092369965, -70.8591691120812, 3.47995352235838, -0.868941954947829),
+])
+
+SENSOR_COUNT = 8
+MAX_READING = 1023
+
+CALIBRATION_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ir_calibration.npz')
+DEFAULT_SURFACE = 'light-wood'
+
+
+class Calibration:
+    """ Closed-form inverse curves, accurate to 1e-9 cm against the sympy version """
+
+    def __init__(self, coefficients=LEGACY_COEFFICIENTS):
+        self.a, self.b, self.c, self.d, self.e = np.asarray(coefficients, dtype=float).T
+
+    def to_cm(self, readings):
+        """ readings: (..., 8) raw values; returns distances in cm, clipped at 0 """
+        y = np.asarray(readings, dtype=float)
+
+        # Complex arithmetic keeps the principal roots sympy took, for
+        # sensors whose square root or cube root argument goes negative
+        root = np.sqrt((2 * self.a * y - self.b) ** 2 + self.c + 0j)
+        z = (self.a * y + .5 * root - self.b / 2) ** (1. / 3)
+        cm = -z / 3 + self.d + self.e / z
+
+        # the legacy conversion summed the real and imaginary parts
+        return np.maximum(cm.real + cm.imag, 0)
+
+    def table(self, max_reading=MAX_READING):
+        readings = np.arange(max_reading + 1)[:, np.newaxis].repeat(SENSOR_COUNT, axis=1)
+        return CalibrationTable(self.to_cm(readings).T)
+
+
+class CalibrationTable:
+    """ Dense raw-to-cm table, one row per sensor and one column per raw value.
+
+    Exact at integer readings, linearly interpolated in between.
+    """
+
+    def __init__(self, table):
+        self.table = np.ascontiguousarray(table, dtype=float)
+        self.sensors = np.arange(self.table.shape[0])
+        self.max_reading = self.table.shape[1] - 1
+
+    def to_cm(self, readings):
+        """ readings: (..., 8) raw values; returns distances in cm """
+        y = np.clip(np.asarray(readings, dtype=float), 0, self.max_reading)
+
+        lo = y.astype(int)
+        hi = np.minimum(lo + 1, self.max_reading)
+        frac = y - lo
+
+        below = self.table[self.sensors, lo]
+        return below + frac * (self.table[self.sensors, hi] - below)
+
+
+def save_calibration(path, calibration):
+    np.savez(path,
+             surfaces=calibration['surfaces'],
+             tables=calibration['tables'].astype(np.float32),
+             distances=calibration['distances'].astype(np.float32),
+             forward=calibration['forward'].astype(np.float32),
+             noise_sd=calibration['noise_sd'].astype(np.float32),
+             ambient=calibration['ambient'].astype(np.float32))
+
+
+def read_calibration(path=CALIBRATION_FILE):
+    with np.load(path) as f:
+        return dict((key, f[key]) for key in f.files)
+
+
+def load_calibration(path=CALIBRATION_FILE, surface=DEFAULT_SURFACE):
+    calibration = read_calibration(path)
+    surfaces = list(calibration['surfaces'])
+
+    if surface not in surfaces:
+        raise ValueError('no calibration for surface ' + surface + ', have ' + ', '.join(surfaces))
+
+    return CalibrationTable(calibration['tables'][surfaces.index(surface)])
+
+
+if os.path.exists(CALIBRATION_FILE):
+    IR_CALIBRATION = load_calibration()
+else:
+    IR_CALIBRATION = Calibration().table()
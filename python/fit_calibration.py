@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+
+# Fits per-sensor, per-surface raw-to-distance models from the
+# ../sensor-stats/*.out files written by sensor_stats.py and saves them
+# as a binary calibration file for calibration.load_calibration.
+
+import glob
+import os
+import re
+import sys
+
+import numpy as np
+from scipy.interpolate import PchipInterpolator
+
+from calibration import CALIBRATION_FILE, MAX_READING, SENSOR_COUNT, save_calibration
+
+META_RE = re.compile(r'META: (?P<surface>.+) - (?P<distance>[0-9.]*)cm - (?P<position>\S+)')
+SENSOR_RE = re.compile(r'SENSOR \[(?P<sensor>\d+)\]\s+MEAN \[(?P<mean>[^\]]+)\]\s+'
+                       r'SD \[(?P<sd>[^\]]+)\]\s+SIZE \[(?P<size>\d+)\]')
+
+# Surface name used for the "no obstacle" recordings
+AMBIENT_SURFACE = 'none'
+
+# Distances (cm) the fitted curves are tabulated over
+DISTANCE_STEP = .01
+
+
+def read_sensor_stats(directory):
+    """ Returns one dict per SENSOR record with its META fields attached """
+    records = []
+
+    for file_name in sorted(glob.glob(os.path.join(directory, '*.out'))):
+        meta = None
+        with open(file_name) as f:
+            for line in f:
+                match = META_RE.match(line)
+                if match:
+                    meta = match.groupdict()
+                    continue
+
+                match = SENSOR_RE.match(line)
+                if match and meta:
+                    records.append(dict(surface=meta['surface'],
+                                        distance=float(meta['distance']) if meta['distance'] else None,
+                                        position=meta['position'],
+                                        sensor=int(match.group('sensor')),
+                                        mean=float(match.group('mean')),
+                                        sd=float(match.group('sd')),
+                                        size=int(match.group('size'))))
+    return records
+
+
+def strongest_readings(records, surface, sensor):
+    """ (distance, mean, sd) per distance from the position facing the sensor most squarely """
+    best = {}
+    for r in records:
+        if r['surface'] == surface and r['sensor'] == sensor:
+            if r['distance'] not in best or r['mean'] > best[r['distance']]['mean']:
+                best[r['distance']] = r
+
+    return [(d, best[d]['mean'], best[d]['sd']) for d in sorted(best)]
+
+
+def fit_sensor(readings, ambient, far_distance):
+    """ Fits reading = f(distance) and returns (distances, forward, inverse table)
+
+    f is a monotone cubic (PCHIP) through the mean reading at each measured
+    distance, so it falls steadily between them where a least-squares cubic
+    wiggled and had to be flattened into plateaus. The inverse table maps
+    every raw value 0..MAX_READING to cm. Readings at or below the ambient
+    level map to far_distance.
+    """
+    distance, mean, sd = np.array(readings).T
+
+    distances = np.arange(0, distance.max() + DISTANCE_STEP / 2, DISTANCE_STEP)
+    forward = PchipInterpolator(distance, mean)(distances)
+
+    knots_cm = distances
+    knots_raw = forward
+    if ambient < forward[-1]:
+        knots_cm = np.append(knots_cm, far_distance)
+        knots_raw = np.append(knots_raw, ambient)
+
+    # np.interp needs increasing x, so walk the curve from far to near
+    raw = np.arange(MAX_READING + 1)
+    inverse = np.interp(raw, knots_raw[::-1], knots_cm[::-1])
+
+    return distances, forward, inverse
+
+
+def residuals(readings, inverse):
+    """ cm error of the inverse table at each measured mean reading """
+    distance, mean, sd = np.array(readings).T
+    return np.interp(mean, np.arange(MAX_READING + 1), inverse) - distance
+
+
+def fit_calibration(directory, far_distance=5.5):
+    records = read_sensor_stats(directory)
+    surfaces = sorted(set(r['surface'] for r in records) - set([AMBIENT_SURFACE]))
+
+    ambient = np.empty(SENSOR_COUNT)
+    for sensor in range(SENSOR_COUNT):
+        ambient[sensor] = np.mean([r['mean'] for r in records
+                                   if r['surface'] == AMBIENT_SURFACE and r['sensor'] == sensor])
+
+    tables = np.empty((len(surfaces), SENSOR_COUNT, MAX_READING + 1))
+    noise_sd = np.empty((len(surfaces), SENSOR_COUNT))
+    residual = np.empty((len(surfaces), SENSOR_COUNT))
+    forward = None
+
+    for i, surface in enumerate(surfaces):
+        for sensor in range(SENSOR_COUNT):
+            readings = strongest_readings(records, surface, sensor)
+            distances, raw, tables[i, sensor] = fit_sensor(readings, ambient[sensor], far_distance)
+
+            if forward is None:
+                forward = np.empty((len(surfaces), SENSOR_COUNT, len(distances)))
+            forward[i, sensor] = raw
+            noise_sd[i, sensor] = np.mean([sd for _, _, sd in readings])
+            residual[i, sensor] = np.abs(residuals(readings, tables[i, sensor])).max()
+
+    return dict(surfaces=np.array(surfaces), tables=tables, distances=distances,
+                forward=forward, noise_sd=noise_sd, ambient=ambient, residual=residual)
+
+
+def main(argv):
+    directory = argv[0] if argv else '../sensor-stats'
+    path = argv[1] if len(argv) > 1 else CALIBRATION_FILE
+
+    calibration = fit_calibration(directory)
+    save_calibration(path, calibration)
+
+    print 'Fitted ' + ', '.join(calibration['surfaces']) + ' -> ' + path
+
+    # worst error at the recorded means, and the largest cm step one raw count makes
+    steps = np.abs(np.diff(calibration['tables'], axis=2)).max(axis=2)
+    for i, surface in enumerate(calibration['surfaces']):
+        print '{:<12} residual cm {}  step cm {}'.format(
+            surface, ' '.join('{:.3f}'.format(r) for r in calibration['residual'][i]),
+            ' '.join('{:.2f}'.format(s) for s in steps[i]))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
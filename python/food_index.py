@@ -0,0 +1,117 @@
+# Food positions hashed into a grid of square cells.
+# With cells at least as large as the dedup radius, everything within the
+# radius of a point lies in its own cell or the eight around it, so
+# marking food and finding what it replaces costs the same however many
+# positions are stored. Nearest-food queries search outward ring by ring.
+
+import math
+from collections import OrderedDict
+
+
+class FoodIndex:
+    def __init__(self, cell_size=20.):
+        self.cell_size = float(cell_size)
+        self.cells = {}  # (cell x, cell y) -> {id: (x, y)}
+        self.items = OrderedDict()  # id -> (x, y), oldest first
+        self.next_id = 0
+
+        # cell bounds ever occupied, which end the nearest-food search
+        self.bounds = None
+
+    def __len__(self):
+        return len(self.items)
+
+    def positions(self):
+        """ All positions, newest first """
+        return list(reversed(self.items.values()))
+
+    def _cell(self, x, y):
+        return (int(math.floor(x / self.cell_size)), int(math.floor(y / self.cell_size)))
+
+    def _neighbourhood(self, x, y, radius):
+        cx, cy = self._cell(x, y)
+        reach = int(math.ceil(radius / self.cell_size))
+        for i in xrange(cx - reach, cx + reach + 1):
+            for j in xrange(cy - reach, cy + reach + 1):
+                cell = self.cells.get((i, j))
+                if cell:
+                    for item in cell.items():
+                        yield item
+
+    def within(self, x, y, radius):
+        """ Positions closer than radius to (x, y) """
+        r2 = radius * radius
+        return [pos for _, pos in self._neighbourhood(x, y, radius)
+                if (pos[0] - x) ** 2 + (pos[1] - y) ** 2 < r2]
+
+    def add(self, x, y, radius=0.):
+        """ Stores (x, y), first dropping any food closer than radius; returns what was dropped """
+        dropped = self.remove_within(x, y, radius) if radius > 0 else []
+
+        key = self._cell(x, y)
+        self.cells.setdefault(key, {})[self.next_id] = (x, y)
+        self.items[self.next_id] = (x, y)
+        self.next_id += 1
+
+        if self.bounds is None:
+            self.bounds = [key[0], key[1], key[0], key[1]]
+        else:
+            b = self.bounds
+            self.bounds = [min(b[0], key[0]), min(b[1], key[1]), max(b[2], key[0]), max(b[3], key[1])]
+        return dropped
+
+    def _remove_id(self, item_id):
+        x, y = self.items.pop(item_id)
+        key = self._cell(x, y)
+        cell = self.cells[key]
+        del cell[item_id]
+        if not cell:
+            del self.cells[key]
+
+    def remove_within(self, x, y, radius):
+        r2 = radius * radius
+        doomed = [(item_id, pos) for item_id, pos in self._neighbourhood(x, y, radius)
+                  if (pos[0] - x) ** 2 + (pos[1] - y) ** 2 < r2]
+        for item_id, _ in doomed:
+            self._remove_id(item_id)
+        return [pos for _, pos in doomed]
+
+    def remove(self, positions):
+        """ Removes every stored copy of each given position """
+        doomed = []
+        for pos in set(positions):
+            cell = self.cells.get(self._cell(*pos), {})
+            doomed.extend(item_id for item_id, p in cell.items() if p == pos)
+        for item_id in doomed:
+            self._remove_id(item_id)
+        return len(doomed)
+
+    def clear(self):
+        self.cells.clear()
+        self.items.clear()
+        self.bounds = None
+
+    def nearest(self, x, y):
+        """ The stored position closest to (x, y), or None """
+        if not self.items:
+            return None
+
+        cx, cy = self._cell(x, y)
+        b = self.bounds
+        last_ring = max(abs(cx - b[0]), abs(cx - b[2]), abs(cy - b[1]), abs(cy - b[3]))
+
+        best, best_d2 = None, float('inf')
+        for ring in xrange(last_ring + 1):
+            # everything in this ring and beyond is at least ring - 1 cells away
+            if best is not None and ring > 1 and best_d2 <= ((ring - 1) * self.cell_size) ** 2:
+                break
+
+            for i in xrange(cx - ring, cx + ring + 1):
+                for j in xrange(cy - ring, cy + ring + 1):
+                    if max(abs(i - cx), abs(j - cy)) != ring:
+                        continue
+                    for pos in self.cells.get((i, j), {}).values():
+                        d2 = (pos[0] - x) ** 2 + (pos[1] - y) ** 2
+                        if d2 < best_d2:
+                            best, best_d2 = pos, d2
+        return best
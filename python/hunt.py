@@ -1,107 +1,177 @@
 #!/usr/bin/env python
 
 import logging
+import sys
 import time
 import traceback
 
 from arena import build_arena
+from enum import Enum
 from particle_filter import ParticleFilter
+from range_table import load_range_table
+from replay import ReplaySerial
 from robot import Robot
+from scheduler import Scheduler
+from simulator import SimulatedKhepera
+from telemetry import TelemetryRecorder
+from viewer import ArenaViewer
 
 
-def main():
-    arena = build_arena('arena_16_small.bmp')
+HuntState = Enum(SEARCH=0, GO_TO_FOOD=1, GO_HOME=2, EVADE=3)
 
-    pf = ParticleFilter(200, arena)
 
-    robot = Robot(pf, arena)
-    robot.set_counts(0, 0)
+class Hunt:
+    """ Search, go-to-food and go-home behaviour as a state machine stepped
+    by the scheduler's obstacle and motion tasks """
 
-    arena.show()
+    def __init__(self, robot):
+        self.robot = robot
 
-    def check_hit_something(turning=0):
-        # print 'turning = ' + str(turning)
-        turn = robot.going_to_hit_obstacle()
-        if turn:  # Blocked
-            arena.show()
-            current_count = robot.read_wheel_counts()
+        self.state = HuntState.SEARCH
 
-            if turning == 1:  # Continue turning away from left
-                robot.turn_at_angle(-20)
-                check_hit_something(turning=turning)
+        # the food being headed for, picked on setting out
+        self.target = None
 
-            elif turning == 2:  # Continue turning away from right
-                robot.turn_at_angle(20)
-                check_hit_something(turning=turning)
+        # while evading: which side the obstacle is on (1 left, 2 right) and
+        # the state to go back to once the way is clear
+        self.evade_side = 0
+        self.resume_state = None
 
-            else:
-                robot.stop()
-                time.sleep(.3)
-                if turn == 1: # Obstacle on left
-                    robot.turn_at_angle(-20)
-                else: # Obstacle on right
-                    robot.turn_at_angle(20)
-                check_hit_something(turning=turn)
+    def goal_state(self):
+        return self.resume_state if self.state == HuntState.EVADE else self.state
 
-    def search_for_food():
-        try:
-            start_time = time.time()
+    def check_obstacles(self):
+        robot = self.robot
+        turn = robot.going_to_hit_obstacle()
 
-            while True: # time.time() < start_time + 6:
-                robot.go(4)
+        if self.state == HuntState.EVADE:
+            if not turn:
+                self.state = self.resume_state
+                return
 
-                time.sleep(.02)
-                check_hit_something()
+        elif turn:  # Blocked
+            robot.stop()
+            robot.sleep(.3)
+            self.evade_side = turn
+            self.resume_state = self.state
+            self.state = HuntState.EVADE
+
+        else:
+            return
+
+        # keep turning away from the side the obstacle was first seen on
+        if self.evade_side == 1:  # Obstacle on left
+            robot.turn_at_angle(-20)
+        else:  # Obstacle on right
+            robot.turn_at_angle(20)
+
+    def drive(self):
+        robot = self.robot
+
+        if self.state == HuntState.SEARCH:
+            robot.go(4)
+
+        elif self.state == HuntState.GO_TO_FOOD:
+            if self.target is None:
+                self.target = robot.next_food()
+
+            if self.target is None or robot.distance(self.target) <= 5:
+                self.target = None
+                self.state = HuntState.SEARCH
+                return
+            robot.face_food(self.target)
+            robot.go(10)
+
+        elif self.state == HuntState.GO_HOME:
+            if robot.distance_home() <= 5:
+                robot.stop()
+                # robot.pinpoint_home()
+                print('HOME')
+                robot.blink_leds()
+                self.state = HuntState.GO_TO_FOOD
+                return
+
+            print 'Distance to home: ' + str(robot.distance_home()) + ' cm'
+            robot.face_home()
+            robot.go(10)
+
+    def interrupt(self):
+        """ Food found: head home from wherever the robot is. On the way home:
+        stop and set out for food again """
+        robot = self.robot
+        robot.stop()
+        self.target = None
 
-                # time.sleep(.02)
-                arena.show()
+        if self.goal_state() in (HuntState.SEARCH, HuntState.GO_TO_FOOD):
+            robot.arena.mark_food()
+            self.state = HuntState.GO_HOME
+        else:
+            self.state = HuntState.GO_TO_FOOD
 
-        except KeyboardInterrupt:
-            go_home()
 
-    def go_home():
-        robot.stop()
-        robot.arena.mark_food()
-        try:
-            while robot.distance_home() > 5:
-                print 'Distance to home: ' + str(robot.distance_home()) + ' cm'
-                robot.face_home()
-                check_hit_something()
-                robot.go(10)
-                # robot.arena.show(wait_time=20)
-                # time.sleep(.02)
-                arena.show()
+def main(argv):
+    arena = build_arena('arena_16_small.bmp')
 
-            robot.stop()
-            # robot.pinpoint_home()
-            print('HOME')
-            robot.blink_leds()
+    range_table = load_range_table(arena, heading_bins=72, max_range=ParticleFilter.SENSOR_MAX_RANGE,
+                                   prefix='arena_16_small')
+    print 'Range table: ' + str(range_table.nbytes / 1024) + ' KiB'
 
+    # --sim drives a simulated Khepera instead of the one on /dev/ttyS0;
+    # --replay <file> feeds back a session captured with --record-serial <file>
+    conn = None
+    if '--sim' in argv:
+        conn = SimulatedKhepera(arena)
+    elif '--replay' in argv:
+        conn = ReplaySerial(argv[argv.index('--replay') + 1], realtime='--realtime' in argv)
 
-        except KeyboardInterrupt:
-            robot.stop()
+    serial_log = argv[argv.index('--record-serial') + 1] if '--record-serial' in argv else None
 
-    def go_to_food():
-        robot.stop()
-        try:
-            while robot.distance(robot.arena.food[0]) > 5:
-                robot.face_food()
-                check_hit_something()
-                robot.go(10)
-                # robot.arena.show(wait_time=20)
-                # time.sleep(.02)
-                arena.show()
-            search_for_food()
-        except KeyboardInterrupt:
-            go_home()
+    # --record <file> writes telemetry for the run
+    recorder = None
+    if '--record' in argv:
+        recorder = TelemetryRecorder(argv[argv.index('--record') + 1], max_particles=200,
+                                     clock=getattr(conn, 'clock', time.time))
+
+    # weigh and resample only every 2 cm or 15 degrees of motion
+    pf = ParticleFilter(200, arena, range_table=range_table, recorder=recorder,
+                        update_distance=2., update_rotation=15.)
 
+    robot = Robot(pf, arena, conn=conn, recorder=recorder, serial_log=serial_log)
+    robot.set_counts(0, 0)
+
+    # --viewer draws the arena in its own process; --video <file> records
+    # the viewer's frames to a file instead of opening a window
+    viewer = None
+    show = arena.show
+    if '--viewer' in argv or '--video' in argv:
+        video = argv[argv.index('--video') + 1] if '--video' in argv else None
+        viewer = ArenaViewer(arena, max_particles=pf.particle_count, video=video)
+        show = viewer.publish
+
+    show()
+
+    # each concern runs as its own periodic task; the robot no longer steps
+    # the particle filter on every speed command. --pf-thread moves the
+    # filter steps themselves onto a background thread
+    robot.localize_on_move = False
+    if '--pf-thread' in argv:
+        robot.start_localizer()
+    scheduler = Scheduler(robot.clock, robot.sleep, on_cycle=robot.begin_tick)
+    hunt = Hunt(robot)
+
+    scheduler.add('obstacles', 10, hunt.check_obstacles, priority=3)
+    scheduler.add('motion', 5, hunt.drive, priority=2)
+    scheduler.add('localize', 5, robot.localize, priority=1)
+    scheduler.add('display', 5, show, priority=0)
 
     try:
-        search_for_food()
-        # robot.pinpoint_home()
-        while True:
-            go_to_food()
-        # corner_to_home(robot)
+        # Ctrl-C marks food while searching, and gives up on going home while
+        # heading there
+        while not scheduler.stopped:
+            try:
+                scheduler.run()
+            except KeyboardInterrupt:
+                hunt.interrupt()
 
     except Exception:
         logging.error(traceback.format_exc())
@@ -109,7 +179,25 @@ def main():
     finally:
         robot.stop(emergency=True)
 
+        if robot.localizer is not None:
+            print 'Localizer: ' + str(robot.localizer.stats())
+            robot.stop_localizer()
+
+        if viewer is not None:
+            viewer.close()
+
+        scheduler.report()
+
+        if isinstance(conn, ReplaySerial):
+            print 'Replay: ' + str(conn.report())
+
+        print 'Sensor cache: ' + str(robot.sensor_cache.stats())
+
+        if recorder is not None:
+            recorder.flush()
+            print 'Telemetry overhead: {:.1f} us per record'.format(recorder.mean_overhead() * 1e6)
+
 
 
 if __name__ == '__main__':
-    main()
+    main(sys.argv[1:])
@@ -0,0 +1,57 @@
+# Likelihood-field measurement model.
+# Precomputes the distance from every grid cell to the nearest obstacle once,
+# then scores a reading by projecting its endpoint and looking the field up.
+
+import numpy as np
+from scipy.ndimage import distance_transform_edt
+
+from sensor_model import SENSOR_ANGLES, SENSOR_OFFSETS, sensor_poses
+
+
+class LikelihoodField:
+    def __init__(self, arena, max_range=5, z_hit=.9, z_rand=.1):
+        self.arena = arena
+        self.max_range = max_range
+        self.z_hit = z_hit
+        self.z_rand = z_rand
+
+        # Pad with a ring of obstacle cells so the map edge counts as a wall,
+        # the same way the ray-caster treats leaving the grid
+        free = np.pad(arena.grid != 0, 1, 'constant', constant_values=False)
+        self.field = distance_transform_edt(free, sampling=(arena.y_sc, arena.x_sc))
+
+    def endpoint_distances(self, xs, ys):
+        """ Distance in cm from each (x, y) in cm to the nearest obstacle """
+        grid_x, grid_y = self.arena.cm_to_grid_array(xs, ys)
+        ht, wd = self.field.shape[0:2]
+        return self.field[np.clip(grid_y + 1, 0, ht - 1), np.clip(grid_x + 1, 0, wd - 1)]
+
+    def log_likelihood(self, xs, ys, headings, readings, std,
+                       sensor_angles=SENSOR_ANGLES, sensor_offsets=SENSOR_OFFSETS):
+        """ Log-likelihood of the readings for every particle, summed over sensors.
+
+        xs, ys and headings (degrees) hold one entry per particle; readings,
+        sensor_angles and sensor_offsets hold one entry per sensor. Readings
+        at or beyond max_range carry no endpoint and are skipped.
+        """
+        readings = np.asarray(readings, dtype=float)
+        used = readings < self.max_range
+
+        ll = np.zeros(len(xs))
+        if not used.any():
+            return ll
+
+        origin_x, origin_y, beam = sensor_poses(
+            xs, ys, headings,
+            np.asarray(sensor_angles, dtype=float)[used],
+            np.asarray(sensor_offsets, dtype=float).reshape(-1, 2)[used])
+
+        beam *= np.pi / 180
+        end_x = origin_x + readings[used] * np.cos(beam)
+        end_y = origin_y + readings[used] * np.sin(beam)
+
+        dist = self.endpoint_distances(end_x, end_y)
+
+        p = self.z_hit * np.exp(-.5 * (dist / std) ** 2) + self.z_rand / self.max_range
+        ll += np.log(p).sum(axis=1)
+        return ll
@@ -0,0 +1,93 @@
+# Runs the particle filter on a background thread.
+# The control loop queues each step's wheel motion and IR distances and
+# moves on; the worker folds whatever has queued up into one filter step
+# (summing the wheel motion, keeping the newest distances) and publishes
+# the estimate to the arena as a single tuple, so readers never see an x
+# from one step with a y from another.
+
+import threading
+import time
+from collections import deque
+from Queue import Empty, Queue
+
+import numpy as np
+
+
+class Localizer(threading.Thread):
+    def __init__(self, particle_filter, arena, clock=time.time, history=1000):
+        threading.Thread.__init__(self, name='Localizer')
+        self.daemon = True
+
+        self.particle_filter = particle_filter
+        self.arena = arena
+        self.clock = clock
+
+        self.queue = Queue()
+        self.steps = 0
+        self.coalesced = 0
+
+        # (measurement time, estimate) of the newest published step
+        self.latest = None
+
+        self.depths = deque(maxlen=history)
+        self.staleness = deque(maxlen=history)
+
+        self._running = threading.Event()
+        self._running.set()
+
+    def submit(self, ticks, distances):
+        """ Queues one step; never waits for the filter """
+        self.queue.put((self.clock(), ticks, distances))
+
+    def _drain(self, timeout=.1):
+        """ The oldest queued step merged with everything queued behind it """
+        try:
+            at, ticks, distances = self.queue.get(timeout=timeout)
+        except Empty:
+            return None
+
+        left, right = ticks
+        while True:
+            try:
+                at, ticks, distances = self.queue.get_nowait()
+            except Empty:
+                break
+            left += ticks[0]
+            right += ticks[1]
+            self.coalesced += 1
+
+        return at, (left, right), distances
+
+    def run(self):
+        while self._running.is_set():
+            self.depths.append(self.queue.qsize())
+
+            step = self._drain()
+            if step is None:
+                continue
+
+            at, ticks, distances = step
+            mu = self.particle_filter.go(ticks, distances)
+
+            self.latest = (at, (mu[0], mu[1]))
+            self.staleness.append(self.clock() - at)
+            self.steps += 1
+
+    def stop(self):
+        self._running.clear()
+        self.join()
+
+    def age(self):
+        """ How old the measurement behind the current estimate is """
+        latest = self.latest
+        return None if latest is None else self.clock() - latest[0]
+
+    def stats(self):
+        depths = np.array(self.depths)
+        staleness = np.array(self.staleness) * 1000
+        stats = dict(steps=self.steps, coalesced=self.coalesced, queued=self.queue.qsize())
+        if len(depths):
+            stats.update(depth_mean=depths.mean(), depth_max=depths.max())
+        if len(staleness):
+            stats.update(stale_ms_mean=staleness.mean(), stale_ms_max=staleness.max())
+        return stats
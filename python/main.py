@@ -2,28 +2,34 @@
 
 import logging
 import pprint
-import time
+import sys
 import traceback
 import turtle
 
 import numpy as np
 
+from arena import build_arena
 from robot import Robot
+from simulator import SimulatedKhepera
 
 
-def main():
-    start_time = time.time()
-    robot = Robot()
+def main(argv):
+    # --sim drives a simulated Khepera instead of the one on /dev/ttyS0
+    conn = SimulatedKhepera(build_arena('arena_16_small.bmp')) if '--sim' in argv else None
+
+    robot = Robot(conn=conn)
+    start_time = robot.clock()
 #    robot.set_wheel_positions(1030,-1030)
     robot.go(10)
-    time.sleep(.02)
+    robot.sleep(.02)
 
     try:
-        while time.time() < start_time + 30:
+        while robot.clock() < start_time + 30:
+            robot.begin_tick()
             ir_result = robot.read_ir()
 
             if robot.continue_turning(ir_result) or robot.avoid_obstacle(ir_result):
-                time.sleep(.02)
+                robot.sleep(.02)
 
             else:
                 robot.set_following_wall(ir_result)
@@ -31,19 +37,21 @@ def main():
                 if not robot.adjust_for_wall(ir_result):
                     robot.go(10)
 
-                time.sleep(.02)
+                robot.sleep(.02)
 
         robot.stop()
-        time.sleep(.5)
+        robot.sleep(.5)
         robot.set_wheel_positions(1036, -1036)
-        time.sleep(2.5)
+        robot.sleep(2.5)
 
-        forward_move_list = list(robot.move_list)
-        backtracking_instructions = reversed(robot.move_list[1:-1])
+        # the moves so far, newest first, without copying them
+        forward_moves = len(robot.trajectory)
+        backtracking_instructions = robot.trajectory[1:-1][::-1]
         for move in backtracking_instructions:
             robot._set_speeds(move['right_speed'], move['left_speed'])
 
             while True:
+                robot.begin_tick()
                 wheel_counts = robot.read_wheel_counts()
 
                 # # robot._set_speeds(0, 0, count_wheels=False)
@@ -70,7 +78,8 @@ def main():
 
         robot.stop()
 
-        backtracking_move_list = list(robot.move_list[len(forward_move_list):])
+        forward_move_list = robot.trajectory[:forward_moves]
+        backtracking_move_list = robot.trajectory[forward_moves:]
 
         t = turtle.Turtle()
         t.screen.setup(width=.9, height=.9)
@@ -81,13 +90,15 @@ def main():
 
         print "FORWARD"
         pp.pprint(forward_move_list)
+        xs, ys, headings = robot.trajectory.integrate(forward_move_list)
+        print "dead-reckoned end of forward run: " + str((xs[-1], ys[-1], headings[-1]))
         trace_robot(forward_move_list[1:-1], t, 'red')
 
         t.left(180)
         t.dot(20, 'purple')
 
         print "BACK"
-        pp.pprint(list(reversed(backtracking_move_list)))
+        pp.pprint(backtracking_move_list[::-1])
 
         trace_robot(backtracking_move_list[:-1], t, 'blue')
 
@@ -100,7 +111,7 @@ def main():
 
         try:
             while True:
-                time.sleep(.02)
+                robot.sleep(.02)
 
         except KeyboardInterrupt:
             pass
@@ -123,7 +134,7 @@ def correct_posn(robot, x, y):
         else:
             robot.set_angle(270)
         robot.go(4)
-        time.sleep(abs(y) / conv)
+        robot.sleep(abs(y) / conv)
         robot.stop()
     if abs(x) > tol:
         if x < 0:
@@ -131,7 +142,7 @@ def correct_posn(robot, x, y):
         else:
             robot.set_angle(180)
         robot.go(4)
-        time.sleep(abs(x) / conv)
+        robot.sleep(abs(x) / conv)
         robot.stop()
 
 
@@ -174,4 +185,4 @@ def trace_robot(move_list, t, dot_color):
 
 
 if __name__ == '__main__':
-    main()
+    main(sys.argv[1:])
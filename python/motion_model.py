@@ -0,0 +1,99 @@
+# Differential-drive odometry.
+# Poses move by the left and right wheel encoder deltas read back from the
+# Khepera: the mean wheel travel along the heading halfway through the
+# turn. The particle filter applies the same model to every particle at
+# once, with noise on each wheel's travel.
+
+import numpy as np
+
+TICKS_TO_CM = .008
+AXLE_CM = 5.3
+
+# numpy >= 1.17 generators can draw straight into an existing array
+_GENERATOR = getattr(np.random, 'Generator', None)
+
+
+def odometry(pose, left_ticks, right_ticks):
+    """ (x cm, y cm, heading degrees) after the wheels turned by the given ticks """
+    x, y, heading = pose
+    left = left_ticks * TICKS_TO_CM
+    right = right_ticks * TICKS_TO_CM
+
+    dtheta = (right - left) / AXLE_CM
+    distance = (left + right) / 2
+    mid = heading * np.pi / 180 + dtheta / 2
+
+    return [x + distance * np.cos(mid), y + distance * np.sin(mid),
+            (heading + dtheta * 180 / np.pi) % 360]
+
+
+class DifferentialDriveModel:
+    """ Vectorized noisy odometry for up to capacity particles.
+
+    Each wheel's travel gets Gaussian noise with sd TICK_NOISE times the
+    ticks moved plus TICK_NOISE_FLOOR ticks. Fresh standard normals are
+    drawn into a preallocated bank every step, and all intermediate results
+    go to scratch buffers.
+    """
+
+    TICK_NOISE = .05
+    TICK_NOISE_FLOOR = 1.
+
+    def __init__(self, capacity, random=np.random):
+        self.capacity = capacity
+        self.random = random
+
+        self._bank = np.empty(2 * capacity)
+
+        self._left = np.empty(capacity)
+        self._right = np.empty(capacity)
+        self._turn = np.empty(capacity)
+        self._trig = np.empty(capacity)
+
+    def _noise(self, n):
+        """ Two views of n fresh standard normals each in the bank """
+        bank = self._bank[:2 * n]
+        if _GENERATOR is not None and isinstance(self.random, _GENERATOR):
+            self.random.standard_normal(out=bank)
+        else:
+            # RandomState can only hand back a new array
+            bank[:] = self.random.standard_normal(2 * n)
+
+        return bank[:n], bank[n:]
+
+    def sample(self, particles, left_ticks, right_ticks):
+        """ Moves the (N x 3) particles in place by noisy wheel travel """
+        n = len(particles)
+        left_noise, right_noise = self._noise(n)
+        left, right = self._left[:n], self._right[:n]
+        turn, trig = self._turn[:n], self._trig[:n]
+
+        # wheel travel in cm
+        np.multiply(left_noise, self.TICK_NOISE * abs(left_ticks) + self.TICK_NOISE_FLOOR, out=left)
+        left += left_ticks
+        left *= TICKS_TO_CM
+        np.multiply(right_noise, self.TICK_NOISE * abs(right_ticks) + self.TICK_NOISE_FLOOR, out=right)
+        right += right_ticks
+        right *= TICKS_TO_CM
+
+        # half the heading change in radians, and the heading halfway through
+        np.subtract(right, left, out=turn)
+        turn /= 2 * AXLE_CM
+        np.multiply(particles[:, 2], np.pi / 180, out=trig)
+        trig += turn
+
+        # mean travel along the mid heading
+        left += right
+        left /= 2
+        np.cos(trig, out=right)
+        right *= left
+        particles[:, 0] += right
+        np.sin(trig, out=right)
+        right *= left
+        particles[:, 1] += right
+
+        turn *= 2 * 180 / np.pi
+        particles[:, 2] += turn
+        particles[:, 2] %= 360
+
+        return particles
@@ -6,21 +6,37 @@ import cv2
 import numpy as np
 
 
-def make_occ_grid(img, n_x, n_y, thresh=.95):
-    np.set_printoptions(threshold=np.inf)
-
-    img /= 255
-    ht, wd, dp = img.shape
+def block_lightness(img, n_x, n_y):
+    """ Mean lightness (0..1) of the first channel over an n_y x n_x grid of
+    equal blocks; leftover pixel rows and columns are ignored """
+    ht, wd = img.shape[0:2]
     x_sz = int(wd / n_x)
     y_sz = int(ht / n_y)
-    occ_grid = np.zeros([n_y, n_x])
-    for x in xrange(n_x):
-        for y in xrange(n_y):
-            block = img[y*y_sz:(y+1)*y_sz, x*x_sz:(x+1)*x_sz, 0]
-            lightness = block.sum() / float(block.size)
-            if lightness > thresh:
-                occ_grid[y, x] = 255
-    return occ_grid
+    blocks = img[:n_y*y_sz, :n_x*x_sz, 0].reshape(n_y, y_sz, n_x, x_sz)
+    return blocks.mean(axis=(1, 3)) / 255.
+
+
+def make_occ_grid(img, n_x, n_y, thresh=.95):
+    """ 255 where a block is lighter than thresh (free), 0 elsewhere.
+    The image is left untouched """
+    return np.where(block_lightness(img, n_x, n_y) > thresh, 255., 0.)
+
+
+def coarsen(occ_grid):
+    """ Halves the resolution; a coarse cell is free only if every cell it
+    covers is free, and cells hanging off the edge count as occupied """
+    ht, wd = occ_grid.shape[0:2]
+    padded = np.zeros([ht + ht % 2, wd + wd % 2])
+    padded[:ht, :wd] = occ_grid
+    return padded.reshape(padded.shape[0] / 2, 2, padded.shape[1] / 2, 2).min(axis=(1, 3))
+
+
+def make_occ_grid_pyramid(img, n_x, n_y, levels=3, thresh=.95):
+    """ [n_y x n_x grid, then each coarser level at half the resolution] """
+    pyramid = [make_occ_grid(img, n_x, n_y, thresh)]
+    for _ in xrange(levels - 1):
+        pyramid.append(coarsen(pyramid[-1]))
+    return pyramid
 
 
 def show_occ_grid(occ_grid, scale):
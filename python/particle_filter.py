@@ -1,63 +1,177 @@
 # import matplotlib.pyplot as plt
 import numpy as np
-import scipy
-import scipy.stats
 
 from filterpy.monte_carlo import systematic_resample
 from numpy.linalg import norm
-from numpy.random import randn
 from numpy.random import seed
-from util import degrees_to_rad
+from likelihood_field import LikelihoodField
+from motion_model import AXLE_CM, TICKS_TO_CM, DifferentialDriveModel
+from sensor_model import SENSOR_ANGLES, SensorModel, sensor_poses
 
 
 # TODO: landmark measurements, integration with robot commands
 class ParticleFilter:
-    def __init__(self, particle_count, arena):
+    def __init__(self, particle_count, arena, range_table=None, sensor_model=SensorModel.BEAM,
+                 adaptive=False, min_particles=100, max_particles=20000, recorder=None, dtype=np.float64,
+                 update_distance=0., update_rotation=0.):
         seed(2)
 
+        # With adaptive set, the particle count is chosen every step by KLD
+        # sampling between min_particles and max_particles; particle_count
+        # always holds the current count
+        self.adaptive = adaptive
+        self.min_particles = min_particles
+        self.max_particles = max_particles if adaptive else particle_count
+        if adaptive:
+            particle_count = min(max(particle_count, min_particles), max_particles)
+
         self.particle_count = particle_count
         self.arena = arena
-        self.life_size_grid = arena.grid
-
-        self.particles = self.create_particles()
-        self.weights = np.zeros(self.particle_count)
-
-        self.arena.particles = self.particles
-
-    def predict(self, particles, u, std, dt=1.):
-        """ move according to control input u (heading change, velocity)
-        with noise Q (std heading change, std velocity)`"""
-
-        N = len(particles)
-        # update heading
-        particles[:, 2] += u[0] + (randn(N) * std[0])
-        particles[:, 2] %= 360
-
-        # move in the (noisy) commanded direction
-        dist = (u[1] * dt) + (randn(N) * std[1])
-        particles[:, 0] += np.cos(particles[:, 2]) * dist
-        particles[:, 1] += np.sin(particles[:, 2]) * dist
-
-        return particles
 
-    def update(self, distance, R):
-        self.weights.fill(1.)
-
-        distances = np.empty([self.particle_count])
+        # optional telemetry.TelemetryRecorder fed on every go
+        self.recorder = recorder
+        self.life_size_grid = arena.grid
 
-        # TODO: add in readings of other sensor values!!
+        # optional precomputed RangeTable replacing the per-step ray march
+        self.range_table = range_table
 
-        for i, p in enumerate(self.particles):
-            coord_in_cm = self.arena.cm_to_grid((p[0], p[1]))
+        self.sensor_model = sensor_model
+        self.likelihood_field = None
+        if sensor_model == SensorModel.LIKELIHOOD_FIELD:
+            self.likelihood_field = LikelihoodField(arena, max_range=self.SENSOR_MAX_RANGE)
 
-            particle_dist = self.arena.distance_to_collision(coord_in_cm[0], coord_in_cm[1], p[2])
+        # Particles and weights are views into fixed-capacity buffers; the
+        # spare pair is the target of the next resample. Each particle
+        # buffer stores x, y and heading as separate contiguous rows of the
+        # chosen dtype, and particles is its (N x 3) transpose. Weights stay
+        # float64 so normalizing doesn't underflow
+        self.dtype = np.dtype(dtype)
+        self._particle_buffers = [self._allocate((3, self.max_particles), self.dtype) for _ in range(2)]
+        self._weight_buffers = [self._allocate(self.max_particles) for _ in range(2)]
+        self._front = 0
 
-            if particle_dist > 5:
-                particle_dist = 5.5
+        self.particles = self.create_particles()
+        self.weights = self._weight_buffers[0][:self.particle_count]
+        self.weights.fill(1. / self.particle_count)
+
+        self.motion_model = DifferentialDriveModel(self.max_particles)
+
+        # (particles x sensors) scratch for weighing, in the particle dtype
+        # and reused every step; process-local, unlike the particle buffers
+        shape = (self.max_particles, len(SENSOR_ANGLES))
+        self._origin_x, self._origin_y, self._beam, self._expected = [
+            np.empty(shape, self.dtype) for _ in range(4)]
+        self._grid_x, self._grid_y = np.empty(shape, np.int32), np.empty(shape, np.int32)
+
+        # KLD resampling scratch, and the particles needed for each count of
+        # occupied bins, so resample_kld reuses the same arrays every step
+        if adaptive:
+            m = self.max_particles
+            self._kld_base = np.arange(m, dtype=float)
+            self._kld_drawn = np.arange(1, m + 1)
+            self._kld_needed = self.kld_particle_count(np.arange(m + 1)).astype(np.int64)
+            self._kld_positions = np.empty(m)
+            self._kld_cumulative = np.empty(m)
+            self._kld_column = np.empty(m, self.dtype)
+            self._kld_keys = np.empty(m, np.int64)
+            self._kld_bins = np.empty(m, np.int64)
+            self._kld_first = np.empty(m, bool)
+
+        # The measurement update and resampling only run once the robot has
+        # travelled update_distance cm or turned update_rotation degrees
+        # since the last one; steps in between only predict
+        self.update_distance = update_distance
+        self.update_rotation = update_rotation
+        self._travelled = 0.
+        self._turned = 0.
+        self.steps = 0
+        self.updates = 0
 
-            distances[i] = particle_dist
+        self.arena.particles = self.particles
 
-        self.weights *= scipy.stats.norm(distances, R).pdf(distance)
+    # IR sensors saturate beyond this many cm
+    SENSOR_MAX_RANGE = 5
+    SENSOR_OUT_OF_RANGE = 5.5
+
+    # KLD sampling: bound on the approximation error, upper 1 - delta
+    # quantile of the standard normal (delta = .01) and (x cm, y cm,
+    # heading degrees) histogram bin size
+    KLD_EPSILON = .05
+    KLD_Z = 2.326
+    KLD_BIN_SIZE = (5., 5., 20.)
+
+    def _allocate(self, shape, dtype=np.float64):
+        return np.zeros(shape, dtype)
+
+    def _particle_view(self, buffer, start, stop):
+        """ (N x 3) view of particles [start, stop) of a column buffer """
+        return self._particle_buffers[buffer][:, start:stop].T
+
+    @property
+    def xs(self):
+        return self.particles[:, 0]
+
+    @property
+    def ys(self):
+        return self.particles[:, 1]
+
+    @property
+    def headings(self):
+        return self.particles[:, 2]
+
+    def bytes_per_particle(self):
+        return 3 * self.dtype.itemsize + self.weights.itemsize
+
+    def predict(self, particles, ticks):
+        """ Moves the particles by the (left, right) wheel tick deltas """
+        return self.motion_model.sample(particles, ticks[0], ticks[1])
+
+    def expected_distances(self):
+        """ (particles x sensors) ranges each particle should read, clamped
+        like the sensors. The same array is reused on the next call """
+        n = len(self.particles)
+        origin_x, origin_y, beam = sensor_poses(self.particles[:, 0], self.particles[:, 1],
+                                                self.particles[:, 2],
+                                                out=(self._origin_x[:n], self._origin_y[:n], self._beam[:n]))
+
+        grid_x, grid_y = self.arena.cm_to_grid_array(origin_x, origin_y,
+                                                     out=(self._grid_x[:n], self._grid_y[:n]))
+
+        distances = self._expected[:n]
+        if self.range_table is not None:
+            self.range_table.lookup(grid_x, grid_y, beam, out=distances)
+        else:
+            self.arena.distances_to_collision(grid_x, grid_y, beam,
+                                              max_range=self.SENSOR_MAX_RANGE, out=distances)
+
+        distances[distances > self.SENSOR_MAX_RANGE] = self.SENSOR_OUT_OF_RANGE
+        return distances
+
+    def log_likelihood(self, distances, R):
+        """ Per-particle log-likelihood of all IR readings (cm, one per sensor) """
+        if self.likelihood_field is not None:
+            return self.likelihood_field.log_likelihood(self.particles[:, 0], self.particles[:, 1],
+                                                        self.particles[:, 2], distances, R)
+
+        measured = np.array(distances, dtype=float)
+        measured[measured > self.SENSOR_MAX_RANGE] = self.SENSOR_OUT_OF_RANGE
+
+        # Gaussian log-likelihood summed over sensors; the normalizing
+        # constant is the same for every particle so it is left out. The
+        # residuals are worked out in place, and summed in float64
+        residuals = self.expected_distances()
+        residuals -= measured
+        residuals /= R
+        np.square(residuals, out=residuals)
+        return -.5 * residuals.sum(axis=1, dtype=np.float64)
+
+    def update(self, distances, R):
+        """ Weights particles by all IR readings at once """
+        self.set_weights(self.log_likelihood(distances, R))
+
+    def set_weights(self, ll):
+        # shift before exponentiating so the best particle has weight 1
+        self.weights[:] = np.exp(ll - ll.max())
 
         self.weights += 1.e-300  # avoid round-off to zero
         self.weights /= sum(self.weights)  # normalize
@@ -82,38 +196,146 @@ class ParticleFilter:
     def neff(self, weights):
         return 1. / np.sum(np.square(weights))
 
-    def resample_from_index(self, particles, weights, indexes):
-        particles[:] = particles[indexes]
-        weights[:] = weights[indexes]
-        weights /= np.sum(weights)
+    def _gather(self, indexes):
+        """ Copies the indexed particles and weights into the spare buffers
+        and swaps them in, without allocating """
+        count = len(indexes)
+        back = 1 - self._front
+
+        particles = self._particle_buffers[back]
+        for column in range(3):
+            np.take(self._particle_buffers[self._front][column], indexes, out=particles[column, :count])
+        weights = self._weight_buffers[back][:count]
+        np.take(self.weights, indexes, out=weights)
+
+        self._front = back
+        self.particle_count = count
+        self.particles = self._particle_view(back, 0, count)
+        self.weights = weights
+
+    def resample(self):
+        """ Systematic resample into the spare buffers """
+        self._gather(systematic_resample(self.weights))
+        self.weights /= np.sum(self.weights)
+
+    def kld_particle_count(self, k):
+        """ Particles needed so the sample stays within KLD_EPSILON of a k-bin posterior """
+        k = np.maximum(np.asarray(k, dtype=float) - 1, 1)
+        a = 2. / (9 * k)
+        return np.ceil(k / (2 * self.KLD_EPSILON) * (1 - a + np.sqrt(a) * self.KLD_Z) ** 3)
+
+    def resample_kld(self):
+        """ Resamples into a particle set sized by KLD sampling """
+        m = self.max_particles
+        n = self.particle_count
+
+        # systematic draw of max_particles indexes from the current set,
+        # shuffled so every prefix is an unbiased sample
+        positions = self._kld_positions
+        np.add(self._kld_base, np.random.random(), out=positions)
+        positions /= m
+        cumulative = self._kld_cumulative[:n]
+        np.cumsum(self.weights, out=cumulative)
+        cumulative[-1] = 1.
+        indexes = np.searchsorted(cumulative, positions)
+        np.random.shuffle(indexes)
+
+        # histogram bin of every drawn particle as one integer key
+        keys, column = self._kld_keys, self._kld_column
+        keys.fill(0)
+        for axis, scale in enumerate((1, 1000003, 1009)):
+            np.take(self.particles[:, axis], indexes, out=column)
+            column /= self.KLD_BIN_SIZE[axis]
+            np.floor(column, out=column)
+            keys *= scale
+            np.add(keys, column, out=keys, casting='unsafe')
+
+        # sorting key * m + draw position groups the draws by bin, earliest
+        # first, so a bin's first draw is where the key changes
+        bins = self._kld_bins
+        keys *= m
+        keys += self._kld_drawn
+        keys -= 1
+        keys.sort()
+        np.floor_divide(keys, m, out=bins)
+        first = self._kld_first
+        first[0] = True
+        np.not_equal(bins[1:], bins[:-1], out=first[1:])
+        np.remainder(keys, m, out=bins)
+
+        # occupied bins after each prefix of the sample, then the particles
+        # that many bins need
+        np.put(keys, bins, first)
+        np.cumsum(keys, out=keys)
+        np.take(self._kld_needed, keys, out=keys)
+
+        enough = first
+        np.greater_equal(self._kld_drawn, keys, out=enough)
+        enough[:max(self.min_particles - 1, 0)] = False
+        count = enough.argmax() + 1 if enough.any() else m
+
+        self._gather(indexes[:count])
+        self.weights.fill(1. / count)
 
     def create_particles(self):
-        particles = np.empty((self.particle_count, 3))
+        particles = self._particle_view(self._front, 0, self.particle_count)
 
         particles[:, 0] = 67
         particles[:, 1] = 15
         particles[:,  2] = np.random.random_integers(0, 359, self.particle_count)
         return particles
 
-    def go(self, movement, angle, sensor_distance, sensor_std_err=.5):
+    def create_uniform_particles(self):
+        """ Spreads the particles over the free space, for global localization """
+        particles = self.particles
+        particles[:, 0], particles[:, 1] = self.arena.sample_free(len(particles))
+        particles[:, 2] = np.random.uniform(0, 360, len(particles))
+        self.weights[:] = 1. / len(particles)
+        return particles
+
+    def update_due(self, ticks):
+        """ Adds the step's odometry to the motion since the last measurement
+        update; True (and the motion reset) once it passes a threshold """
+        left = ticks[0] * TICKS_TO_CM
+        right = ticks[1] * TICKS_TO_CM
+        self._travelled += abs(left + right) / 2
+        self._turned += abs(right - left) / AXLE_CM * 180 / np.pi
+        self.steps += 1
+
+        if self._travelled < self.update_distance and self._turned < self.update_rotation:
+            return False
 
-        # TODO
-        # print "SENSOR DISTANCE: " + str(sensor_distance)
+        self._travelled = self._turned = 0.
+        self.updates += 1
+        return True
 
-        self.particles = self.predict(self.particles, u=(angle, movement), std=(.2, .05))
+    def go(self, ticks, sensor_distances, sensor_std_err=.5):
+        """ One filter step: ticks is the (left, right) wheel count change
+        since the last step """
+        self.particles = self.predict(self.particles, ticks)
 
         self.arena.particles = self.particles
 
-        self.update(sensor_distance, sensor_std_err)
+        if self.update_due(ticks):
+            self.update(sensor_distances, sensor_std_err)
+
+            if self.adaptive:
+                self.resample_kld()
+                self.arena.particles = self.particles
 
-        if self.neff(self.weights) < self.particle_count / 2:
-            indexes = systematic_resample(self.weights)
-            self.resample_from_index(self.particles, self.weights, indexes)
+            elif self.neff(self.weights) < self.particle_count / 2:
+                self.resample()
+                self.arena.particles = self.particles
 
+        return self.publish_estimate()
+
+    def publish_estimate(self):
         mu, var = self.estimate(self.particles, self.weights)
 
-        self.arena.pf_robot_x = mu[0]
-        self.arena.pf_robot_y = mu[1]
+        self.arena.pf_estimate = (mu[0], mu[1])
+
+        if self.recorder is not None:
+            self.recorder.record_particle_filter(mu, var, self.particles)
 
         return mu
 
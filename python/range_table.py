@@ -0,0 +1,81 @@
+# Precomputed expected IR ranges for a static arena.
+# Indexed by (grid x, grid y, heading bin), built once with the batch
+# ray-caster and memory-mapped from disk on later runs.
+
+import hashlib
+import os
+
+import numpy as np
+
+
+class RangeTable:
+    # lookups done together; bounds the temporaries however many are asked for
+    CHUNK = 8192
+
+    def __init__(self, table, max_range):
+        self.table = table
+        self.max_range = max_range
+        self.heading_bins = table.shape[2]
+        self.bin_size = 360.0 / self.heading_bins
+
+    @property
+    def nbytes(self):
+        return self.table.nbytes
+
+    def heading_to_bin(self, angles):
+        return np.round(np.asarray(angles) / self.bin_size).astype(int) % self.heading_bins
+
+    def lookup(self, grid_x, grid_y, angles, out=None):
+        """ Gathers the expected range for each (grid x, grid y, angle).
+
+        Cells outside the map read as an immediate collision. With out (a
+        contiguous array of the lookups' shape) given, the ranges go there.
+        """
+        grid_x = np.asarray(grid_x)
+        distances = np.empty(grid_x.shape, dtype=self.table.dtype) if out is None else out
+
+        grid_x, grid_y, angles = grid_x.ravel(), np.asarray(grid_y).ravel(), np.asarray(angles).ravel()
+        flat = distances.reshape(-1)
+        for start in range(0, grid_x.size, self.CHUNK):
+            chunk = slice(start, start + self.CHUNK)
+            flat[chunk] = self._lookup(grid_x[chunk], grid_y[chunk], angles[chunk])
+
+        return distances
+
+    def _lookup(self, grid_x, grid_y, angles):
+        bins = self.heading_to_bin(angles)
+
+        wd, ht = self.table.shape[0:2]
+        inside = (grid_x >= 0) & (grid_x < wd) & (grid_y >= 0) & (grid_y < ht)
+
+        distances = np.ones(bins.shape, dtype=self.table.dtype)
+        distances[inside] = self.table[grid_x[inside], grid_y[inside], bins[inside]]
+        return distances
+
+
+def build_range_table(arena, heading_bins=72, max_range=5):
+    ht, wd = arena.grid.shape[0:2]
+    grid_x, grid_y, bins = np.meshgrid(np.arange(wd), np.arange(ht), np.arange(heading_bins),
+                                       indexing='ij')
+
+    distances = arena.distances_to_collision(grid_x, grid_y, bins * (360.0 / heading_bins),
+                                             max_range=max_range)
+
+    dtype = np.uint8 if max_range < np.iinfo(np.uint8).max else np.uint16
+    return RangeTable(distances.astype(dtype), max_range)
+
+
+def range_table_path(arena, heading_bins, max_range, prefix='arena'):
+    # The grid digest keeps a stale table from being loaded after the map changes
+    digest = hashlib.md5(np.ascontiguousarray(arena.grid).tostring()).hexdigest()[:8]
+    return '{}.{}x{}.{}.range.npy'.format(prefix, heading_bins, max_range, digest)
+
+
+def load_range_table(arena, heading_bins=72, max_range=5, prefix='arena'):
+    """ Memory-maps a previously saved table, building and saving it first if needed """
+    path = range_table_path(arena, heading_bins, max_range, prefix)
+
+    if not os.path.exists(path):
+        np.save(path, build_range_table(arena, heading_bins, max_range).table)
+
+    return RangeTable(np.load(path, mmap_mode='r'), max_range)
@@ -0,0 +1,78 @@
+# Draws the arena for display.
+# The occupancy grid never changes during a run, so it is rasterized once
+# and copied into a reused frame; every frame then only scatters the
+# particles in one indexed assignment and draws the handful of markers.
+
+import cv2
+import numpy as np
+
+
+def disc_offsets(radius):
+    """ (dy, dx) of the pixels cv2.circle fills for a disc of this radius """
+    size = 2 * radius + 1
+    stencil = np.zeros([size, size], np.uint8)
+    cv2.circle(stencil, (radius, radius), radius, 255, -1)
+    dy, dx = np.nonzero(stencil)
+    return dy - radius, dx - radius
+
+
+class ArenaRenderer:
+    def __init__(self, arena, scale=5):
+        self.arena = arena
+        self.scale = scale
+
+        self.grid = None
+        self.background = None
+        self.frame = None
+        self.particle_dy, self.particle_dx = disc_offsets(scale / 2)
+
+    def _rasterize(self):
+        grid = self.arena.grid
+        cells = np.repeat(np.repeat(grid[::-1], self.scale, axis=0), self.scale, axis=1)
+        self.background = np.repeat(cells[:, :, np.newaxis], 3, axis=2).astype(np.uint8)
+        self.frame = np.empty_like(self.background)
+        self.grid = grid
+
+    def to_img(self, xs, ys):
+        """ Vectorized Arena.cm_to_img at this renderer's scale """
+        arena = self.arena
+        ht = arena.grid.shape[0]
+        return ((xs / arena.x_sc * self.scale).astype(int),
+                ht * self.scale - (ys / arena.y_sc * self.scale).astype(int))
+
+    def splat(self, img, xs, ys, color):
+        """ Draws a small disc at every (x, y) cm position at once """
+        img_xs, img_ys = self.to_img(xs, ys)
+        img_xs = (img_xs[:, np.newaxis] + self.particle_dx).ravel()
+        img_ys = (img_ys[:, np.newaxis] + self.particle_dy).ravel()
+
+        ht, wd = img.shape[0:2]
+        inside = (img_xs >= 0) & (img_xs < wd) & (img_ys >= 0) & (img_ys < ht)
+        img[img_ys[inside], img_xs[inside]] = color
+
+    def render(self):
+        """ The current frame. The same array is reused on the next call """
+        arena = self.arena
+        scale = self.scale
+
+        if self.grid is not arena.grid:
+            self._rasterize()
+        img = self.frame
+        np.copyto(img, self.background)
+
+        for food_pos in arena.food:
+            cv2.circle(img, arena.cm_to_img(food_pos, scale=scale), scale, arena.PURPLE, -1)
+
+        particles = np.asarray(arena.particles, dtype=float)
+        if len(particles):
+            self.splat(img, particles[:, 0], particles[:, 1], arena.RED)
+
+        coord = arena.cm_to_img((arena.robot_x, arena.robot_y), scale=scale)
+        pf_coord = arena.cm_to_img(arena.pf_estimate, scale=scale)
+        home_coord = arena.cm_to_img((arena.home_x, arena.home_y), scale=scale)
+
+        cv2.circle(img, coord, scale * 3 / 2, arena.GREEN, -1)
+        cv2.circle(img, pf_coord, scale * 3 / 2, arena.BLUE, -1)
+        cv2.circle(img, home_coord, scale * 5, arena.BLACK, 1)
+
+        return img
@@ -0,0 +1,188 @@
+# Serial session capture and replay.
+# RecordingSerial wraps the real port and logs every command with the reply
+# the Khepera gave; ReplaySerial feeds those replies back to Robot in order,
+# at recorded pace or as fast as possible, and reports every point where
+# the replayed code sends something other than what was recorded.
+
+import json
+import time
+
+
+class RecordingSerial:
+    """ Passes through to conn and appends (time, command, reply) lines to path """
+
+    def __init__(self, conn, path, clock=time.time):
+        self.conn = conn
+        self.clock = clock
+        self.log = open(path, 'w')
+        self.start = clock()
+        self.sent = []
+
+    def __getattr__(self, name):
+        # pass through anything else the wrapped connection offers (clock, sleep)
+        if name == 'conn':
+            raise AttributeError(name)
+        return getattr(self.conn, name)
+
+    def isOpen(self):
+        return self.conn.isOpen()
+
+    def open(self):
+        self.conn.open()
+
+    def close(self):
+        self.log.close()
+        self.conn.close()
+
+    def inWaiting(self):
+        return self.conn.inWaiting()
+
+    def write(self, data):
+        self.sent.extend(c for c in data.splitlines() if c)
+        return self.conn.write(data)
+
+    def readline(self):
+        reply = self.conn.readline()
+
+        # replies come back in command order; an unanswered command is
+        # logged when the next reply shows up under a different letter
+        command = ''
+        while self.sent:
+            candidate = self.sent.pop(0)
+            if reply and reply[0] == candidate[0].lower():
+                command = candidate
+                break
+            self._log(candidate, '')
+
+        self._log(command, reply)
+        return reply
+
+    def _log(self, command, reply):
+        self.log.write(json.dumps([round(self.clock() - self.start, 6), command, reply]) + '\n')
+        self.log.flush()
+
+
+def load_serial_session(path):
+    with open(path) as f:
+        return [tuple(json.loads(line)) for line in f if line.strip()]
+
+
+class ReplaySerial:
+    """ Answers Robot's commands from a recorded session.
+
+    With realtime set each reply is held back until its recorded time;
+    otherwise replies are immediate. A command that does not match the
+    next recorded one is a divergence: it is logged, and the replay skips
+    ahead to the next recorded command with the same letter (within
+    lookahead entries) so the session can stay in step.
+    """
+
+    def __init__(self, path, realtime=False, lookahead=20, verbose=True):
+        self.exchanges = load_serial_session(path)
+        self.position = 0
+        self.pending = []
+
+        self.realtime = realtime
+        self.lookahead = lookahead
+        self.verbose = verbose
+        self.start = time.time()
+
+        self.divergences = []
+        self.is_open = True
+        self.replayed_time = 0.
+        self.exhausted = False
+        self.last_reply = {}
+
+    def isOpen(self):
+        return self.is_open
+
+    def open(self):
+        self.is_open = True
+
+    def close(self):
+        self.is_open = False
+
+    def inWaiting(self):
+        return sum(len(reply) for _, reply in self.pending)
+
+    def clock(self):
+        if self.realtime:
+            return time.time() - self.start
+        return self.replayed_time
+
+    def sleep(self, seconds):
+        # at maximum speed the replayed clock jumps ahead instead, so code
+        # waiting on it (like the scheduler) still sees time pass
+        if self.realtime:
+            time.sleep(seconds)
+        else:
+            self.replayed_time += seconds
+
+    def finished(self):
+        return self.position >= len(self.exchanges)
+
+    def write(self, data):
+        for command in data.splitlines():
+            if command:
+                self.pending.append(self._answer(command))
+        return len(data)
+
+    def readline(self):
+        if not self.pending:
+            return ''
+
+        at, reply = self.pending.pop(0)
+        self.replayed_time = max(self.replayed_time, at)
+        if self.realtime:
+            delay = self.start + at - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        return reply
+
+    def _answer(self, command):
+        if self.finished():
+            self._diverge(command, None)
+
+            # stop the replayed run once; cleanup commands after that
+            # (stopping the motors, say) get stand-in replies
+            if not self.exhausted:
+                self.exhausted = True
+                raise EOFError('replay session exhausted after {} exchanges'.format(len(self.exchanges)))
+            return (self.replayed_time, self._stand_in(command))
+
+        at, recorded, reply = self.exchanges[self.position]
+        if command == recorded:
+            self.position += 1
+            return self._replied(at, command, reply)
+
+        self._diverge(command, recorded)
+
+        # resynchronize on the next recorded command with the same letter
+        end = min(self.position + self.lookahead, len(self.exchanges))
+        for i in range(self.position, end):
+            at, recorded, reply = self.exchanges[i]
+            if recorded and recorded[0] == command[0]:
+                self.position = i + 1
+                return self._replied(at, command, reply)
+
+        return (at, self._stand_in(command))
+
+    def _replied(self, at, command, reply):
+        if reply:
+            self.last_reply[command[0]] = reply
+        return (at, reply)
+
+    def _stand_in(self, command):
+        """ Reply for a command the session can't answer: the last recorded
+        reply to the same letter (so sensor reads still parse), else a bare
+        acknowledgement """
+        return self.last_reply.get(command[0], command[0].lower() + '\r\n')
+
+    def _diverge(self, command, expected):
+        self.divergences.append(dict(position=self.position, sent=command, expected=expected))
+        if self.verbose:
+            print 'REPLAY DIVERGENCE at {}: sent {!r}, recorded {!r}'.format(self.position, command, expected)
+
+    def report(self):
+        return dict(exchanges=len(self.exchanges), replayed=self.position,
+                    divergences=len(self.divergences))
@@ -1,26 +1,65 @@
+import threading
 import time
+from collections import deque
 
 import numpy as np
 import serial
 
+from localizer import Localizer
+from motion_model import odometry
+from replay import RecordingSerial
+from sensor_cache import SensorCache
+from sensor_poller import SensorPoller
+from trajectory import Trajectory
 from util import normalize_sensor_readings, safe_arctan
 from wall import Wall
 import arena
 
 
 class Robot:
-    def __init__(self, particle_filter=None, arena=None):
-        self.conn = self._open_connection()
+    def __init__(self, particle_filter=None, arena=None, conn=None, recorder=None, serial_log=None):
+        # conn stands in for the serial port, e.g. a simulator.SimulatedKhepera
+        # or a replay.ReplaySerial
+        self.conn = conn if conn is not None else self._open_connection()
+
+        # a simulated or replayed connection brings its own clock
+        self.clock = getattr(self.conn, 'clock', time.time)
+        self.sleep = getattr(self.conn, 'sleep', time.sleep)
+
+        # serial_log captures every exchange for replay.ReplaySerial
+        if serial_log:
+            self.conn = RecordingSerial(self.conn, serial_log, self.clock)
+
         self.following_wall = Wall.NONE
         self.__turning_to_evade = False
-        self.move_list = [dict(left_speed=0, right_speed=0)]
+        self.trajectory = Trajectory()
+        self.trajectory.append(self.clock(), 0, 0)
         self.current_speed = (0, 0)
         self.pose = [0, 0, 0]
         self.arena = arena
         self.prev_count = (0, 0)
 
-        self.set_counts(0, 0)
+        # recent round-trip times in seconds, keyed by command letter
+        self.command_latency = {}
+
+        # serializes the link between control code and the SensorPoller
+        self.serial_lock = threading.RLock()
+        self.poller = None
+
+        # optional telemetry.TelemetryRecorder fed on every speed command
+        self.recorder = recorder
+
+        # IR, distances and wheel counts read during the current tick
+        self.sensor_cache = SensorCache(self.clock, self.SENSOR_MAX_AGE)
+
+        # the particle filter steps on every move unless localize_on_move is
+        # cleared, in which case the caller runs localize() on its own schedule
         self.particle_filter = particle_filter
+        self.localize_on_move = True
+        self.pf_count = (0, 0)
+        self.localizer = None
+
+        self.set_counts(0, 0)
 
     CURVE_LEFT_VAL = (11, 13)
     CURVE_RIGHT_VAL = CURVE_LEFT_VAL[::-1]
@@ -33,6 +72,12 @@ class Robot:
 
     WALL_FOLLOWING_MIN = 150
 
+    # seconds a cached reading stays usable within a tick
+    SENSOR_MAX_AGE = .1
+
+    # seconds a polled sample stays usable; older means the poller stalled
+    SAMPLE_MAX_AGE = .2
+
     TICKS_TO_CM = .008
     DEGREES_TO_TICKS = 1010.0 / 180
     # DEGREES_TO_TICKS = 815.0 / 180
@@ -61,7 +106,24 @@ class Robot:
         if self.conn.isOpen():
             self.conn.close()
 
-    def _send_command(self, command, verbose=False):
+    LATENCY_HISTORY = 1000
+
+    def _record_latency(self, command, seconds):
+        letter = command[0].upper()
+        if letter not in self.command_latency:
+            self.command_latency[letter] = deque(maxlen=self.LATENCY_HISTORY)
+        self.command_latency[letter].append(seconds)
+
+    def latency_stats(self):
+        """ Per-command round-trip latency in ms over the recent history """
+        stats = {}
+        for letter, times in self.command_latency.items():
+            ms = np.array(times) * 1000
+            stats[letter] = dict(count=len(ms), mean=ms.mean(), p50=np.percentile(ms, 50),
+                                 p90=np.percentile(ms, 90), max=ms.max())
+        return stats
+
+    def _flush_input(self, verbose=False):
         if self.conn.inWaiting() > 0:
 
             if verbose:
@@ -74,11 +136,62 @@ class Robot:
                 if verbose:
                     print message
 
+    def _send_commands(self, commands, verbose=False):
+        """ Writes all commands back-to-back, then reads the replies.
+
+        Replies are matched to commands by their leading letter, so the
+        result lists each command's answer in the order given ('' if the
+        robot never answered it).
+        """
+        with self.serial_lock:
+            return self._exchange(commands, verbose)
+
+    def _exchange(self, commands, verbose):
+        self._flush_input(verbose)
+
+        commands = [c if c[-1] == "\n" else c + "\n" for c in commands]
+
+        start = self.clock()
+        self.conn.write("".join(commands))
+
+        answers = [""] * len(commands)
+        for _ in commands:
+            answer = self.conn.readline()
+            if not answer:
+                break
+
+            for i, command in enumerate(commands):
+                if not answers[i] and answer[0] == command[0].lower():
+                    answers[i] = answer
+                    self._record_latency(command, self.clock() - start)
+                    break
+            else:
+                if verbose:
+                    print "WARNING! Unexpected response: " + answer[:-1]
+
+        if verbose:
+            for command, answer in zip(commands, answers):
+                print "SENT     : " + command[:-1]
+                print "RECEIVED : " + answer[:-1]
+
+        return answers
+
+    def _send_command(self, command, verbose=False):
+        with self.serial_lock:
+            return self._send_one(command, verbose)
+
+    def _send_one(self, command, verbose):
+        self._flush_input(verbose)
+
         if command[-1] != "\n":
             command += "\n"
+
+        start = self.clock()
         self.conn.write(command)
 
         answer = self.conn.readline()
+        if answer:
+            self._record_latency(command, self.clock() - start)
 
         # now we can check if the response from the Khepera matches our
         # expectations
@@ -103,35 +216,109 @@ class Robot:
             print 'PARSE ISSUE'
             return -1
 
+    def _parse_counts(self, count_string):
+        count_list = self._parse_sensor_string(count_string)
+        try:
+            return dict(left=float(count_list[0]), right=float(count_list[1]))
+        except (TypeError, IndexError):
+            return None
+
+    def snapshot(self):
+        """ IR readings and wheel counts from a single pipelined exchange """
+        ir_string, count_string = self._send_commands(["N", "H"])
+
+        ir = self._parse_sensor_string(ir_string)
+        counts = self._parse_counts(count_string)
+
+        if ir == -1 or counts is None:
+            return self.snapshot()
+
+        return dict(ir=ir, counts=counts)
+
+    def start_polling(self, rate=20., history=256):
+        """ Moves IR and wheel-count reads onto a background SensorPoller """
+        if self.poller is None:
+            self.poller = SensorPoller(self, rate, history)
+            self.poller.start()
+
+    def stop_polling(self):
+        if self.poller is not None:
+            self.poller.stop()
+            self.poller = None
+
+    def latest_sample(self):
+        """ The poller's newest Sample, or None when not polling, invalidated
+        or stale, in which case callers read the serial port themselves """
+        if self.poller is None:
+            return None
+
+        sample = self.poller.latest
+        if sample is None or self.clock() - sample.time > self.SAMPLE_MAX_AGE:
+            return None
+        return sample
+
+    def begin_tick(self):
+        """ Marks the start of a control tick; sensor values read before it are stale """
+        self.sensor_cache.begin_tick()
+
     def _set_speeds(self, left, right, homing=False):
         # if not homing and self.current_speed == (left, right):
         #     return
 
-        counts = self.read_wheel_counts()
-
-        left_count = counts['left'] - self.prev_count[0]
-        right_count = counts['right'] - self.prev_count[1]
+        # wheel counts, IR (only needed for the particle filter) and the new
+        # speeds all go out in one exchange, less whatever this tick's cache
+        # or the poller already has
+        cache = self.sensor_cache
+        sample = self.latest_sample()
 
-        self.move_list[-1]['left_wheel_count'] = left_count
-        self.move_list[-1]['right_wheel_count'] = right_count
+        counts = cache.lookup('counts')
+        if counts is None and sample is not None:
+            counts = dict(sample.counts)
+            cache.put('counts', counts)
 
-        self.update_pose()
-
-        self.move_list.append(dict(left_speed=left, right_speed=right))
+        ir = None
+        if self.arena:
+            ir = cache.lookup('ir')
+            if ir is None and sample is not None:
+                ir = list(sample.ir)
+                self._store_ir(ir)
+
+        commands = ["H"] if counts is None else []
+        if self.arena and ir is None:
+            commands.append("N")
+        commands.append("D," + str(int(left)) + "," + str(int(right)))
+
+        answers = self._send_commands(commands)
+        answer = answers[-1]
+
+        if counts is None:
+            counts = self._parse_counts(answers[0])
+            if counts is None:
+                counts = self._fetch_wheel_counts()
+            cache.put('counts', counts)
+
+        if self.arena and ir is None:
+            ir = self._parse_sensor_string(answers[-2])
+            if ir == -1:
+                ir = self._fetch_ir()
+            self._store_ir(ir)
+
+        left_count, right_count = self.update_pose(counts)
+        self.trajectory.append(self.clock(), left, right)
 
         if self.arena:
             mean_count = (left_count + right_count) / 2.0
             cm = mean_count * self.TICKS_TO_CM
 
-            sensor_count = normalize_sensor_readings(self.read_ir())
-
             self.arena.add_straight(cm)
-            self.particle_filter.go(cm, 0, np.mean((sensor_count[3], sensor_count[4])))
+            if self.localize_on_move:
+                self.localize()
 
-        self.prev_count = (counts['left'], counts['right'])
+        if self.recorder is not None:
+            self.recorder.record_robot(ir, counts, (left, right))
 
         self.current_speed = (left, right)
-        return self._send_command("D," + str(int(left)) + "," + str(int(right)))
+        return answer
 
     def _toggle_leds(self):
         self._send_command("L,0,2")
@@ -140,28 +327,28 @@ class Robot:
     def blink_leds(self):
         for i in range(6):
             self._toggle_leds()
-            time.sleep(.05)
+            self.sleep(.05)
 
     def set_angle(self, angle):
         self.stop()
-        time.sleep(.5)
+        self.sleep(.5)
 
         delta_angle = (angle - self.pose[2]) % 360
         counts = delta_angle * self.DEGREES_TO_TICKS
 
         self.set_wheel_positions(int(-1 * counts), int(counts))
-        self.pose[2] = angle % 360
+        self.sleep(2)
 
-        time.sleep(2)
+        self.update_pose(self.read_wheel_counts())
 
     def go_home(self):
-        tol = 50
+        tol = 5
         while abs(self.pose[0]) > tol or abs(self.pose[1]) > tol:
             ir_result = self.read_ir()
 
             if self.continue_turning(ir_result) or self.avoid_obstacle(ir_result):
                 print "turning"
-                time.sleep(.02)
+                self.sleep(.02)
 
             else:
                 angle = 180 + safe_arctan(float(self.pose[0]), float(self.pose[1])) * 180 / np.pi
@@ -173,14 +360,20 @@ class Robot:
                     self.set_angle(angle)
 
                 self.go(6, homing=True)
-                time.sleep(.02)
+                self.sleep(.02)
 
         self.stop()
 
-    def face_food(self):
-        if self.arena and self.arena.food:
-            dx = self.arena.robot_x - self.arena.food[0][0]
-            dy = self.arena.robot_y - self.arena.food[0][1]
+    def next_food(self):
+        """ The marked food nearest the robot, or None """
+        if self.arena:
+            return self.arena.nearest_food()
+
+    def face_food(self, food=None):
+        food = food or self.next_food()
+        if food:
+            dx = self.arena.robot_x - food[0]
+            dy = self.arena.robot_y - food[1]
             angle = 180 + np.arctan2(dy, dx) * 180 / np.pi
             self.turn_to_angle(angle)
 
@@ -205,13 +398,27 @@ class Robot:
             return np.sqrt(dx * dx + dy * dy)
 
     def read_ir(self):
-        ir_string = self._send_command("N")
+        return self.sensor_cache.get('ir', self._fetch_ir)
 
-        try:
-            return self._parse_sensor_string(ir_string)
+    def read_distances(self):
+        """ IR readings converted to cm """
+        return self.sensor_cache.get('distances', lambda: normalize_sensor_readings(self.read_ir()))
 
-        except (ValueError, TypeError):
-            return self.read_ir()
+    def _store_ir(self, ir):
+        self.sensor_cache.put('ir', ir)
+        self.sensor_cache.invalidate('distances')
+
+    def _fetch_ir(self):
+        sample = self.latest_sample()
+        if sample is not None:
+            return list(sample.ir)
+
+        ir_string = self._send_command("N")
+
+        ir = self._parse_sensor_string(ir_string)
+        if ir == -1:
+            return self._fetch_ir()
+        return ir
 
     def go(self, speed, homing=False, wonky=False):
         if wonky and speed != 0:
@@ -227,32 +434,50 @@ class Robot:
         return self._set_speeds(left, right)
 
     def read_wheel_counts(self):
-        count_string = self._send_command("H")
-        count_list = self._parse_sensor_string(count_string)
-        try:
-            return dict(left=float(count_list[0]), right=float(count_list[1]))
-        except (TypeError, IndexError):
-            return self.read_wheel_counts()
+        return self.sensor_cache.get('counts', self._fetch_wheel_counts)
+
+    def _fetch_wheel_counts(self):
+        sample = self.latest_sample()
+        if sample is not None:
+            return dict(sample.counts)
+
+        counts = self._parse_counts(self._send_command("H"))
+        if counts is None:
+            return self._fetch_wheel_counts()
+        return counts
 
     def set_counts(self, left_count, right_count):
-        return self._send_command("G," + str(left_count) + "," + str(right_count))
+        answer = self._send_command("G," + str(left_count) + "," + str(right_count))
+
+        self.prev_count = self.pf_count = (left_count, right_count)
+        self.sensor_cache.invalidate('counts')
+
+        # polled counts from before the reset no longer apply
+        if self.poller is not None:
+            self.poller.invalidate()
+        return answer
 
     def set_wheel_positions(self, left_count, right_count):
         # self.set_counts(0, 0)
         counts = self._parse_sensor_string(self._send_command("H"))
 
-        return self._send_command("C," + str(int(counts[0] + left_count)) + "," + str(int(counts[1] + right_count)))
+        answer = self._send_command("C," + str(int(counts[0] + left_count)) + "," + str(int(counts[1] + right_count)))
+
+        # the wheels are moving: nothing read so far this tick still holds
+        self.sensor_cache.invalidate()
+        return answer
 
     def turn_at_angle(self, degrees):
         self.stop()
         counts = (1025 * degrees) / 180
         self.set_wheel_positions(-counts, counts)
-        time.sleep(1)
+        self.sleep(1)
 
-        sensor_count = normalize_sensor_readings(self.read_ir())
-        self.particle_filter.go(0, degrees, np.mean((sensor_count[3], sensor_count[4])))
+        # the turn as the encoders saw it
+        self.update_pose(self.read_wheel_counts())
+        if self.localize_on_move:
+            self.localize()
 
-        self.pose[2] = (self.pose[2] + degrees) % 360
         if self.arena:
             self.arena.add_angle(degrees)
 
@@ -267,7 +492,7 @@ class Robot:
     def going_to_hit_obstacle(self):
         """ Should (hopefully) supersede #avoid_obstacle """
 
-        distances = normalize_sensor_readings(self.read_ir())
+        distances = self.read_distances()
 
         print "DISTANCES: " + str(distances)
 
@@ -280,65 +505,46 @@ class Robot:
             return 2
 
     def get_distances(self, inds):
-        distances = normalize_sensor_readings(self.read_ir())
+        distances = self.read_distances()
         print "DISTANCES: " + str(distances)
         dists = []
         for i in inds:
             dists.append(distances[i])
         return dists
 
-    def update_pose(self):
-        move = self.move_list[-1]
-
-        # robot moves straight
-        if move['left_speed'] == move['right_speed']:
-            distance = .08 * np.mean([move['left_wheel_count'], move['right_wheel_count']])
-            self.pose[0] += distance * np.cos(self.pose[2] * np.pi / 180)
-            self.pose[1] += distance * np.sin(self.pose[2] * np.pi / 180)
-
-        # robot turns in place
-        elif abs(move['left_speed']) == abs(move['right_speed']):
-            print "rotating"
-            # wheel counts aren't perfect, so take the mean to get the turn
-            distance = np.mean([abs(move['left_wheel_count']), abs(move['right_wheel_count'])])
-
-            # 1045 wheel turns is 180 degrees, so use this ratio to determine the angle
-            # 180 / 1045 = angle / distance
-            angle = (180 * distance) / 1025
-            # robot turns right
-            if move['left_speed'] > move['right_speed']:
-                angle *= -1
-            self.pose[2] = (self.pose[2] + angle) % 360
-
-        # robot turns and moves at the same time
-        else:
-            print "turning"
-            if move['left_speed'] > move['right_speed']:
-                # r = 50.0 / (move['left_wheel_count'] / move['right_wheel_count'] - 1)
-                r = 410.0 / 2
-                theta = move['right_wheel_count'] * .08 / (2 * np.pi * r) * 360
-                # self.pose[1] -= r * np.sin(theta * np.pi / 180) * np.sin(self.pose[2] * np.pi / 180)
-                # self.pose[1] -= r * (1 - np.cos(theta * np.pi / 180)) * np.cos(self.pose[2] * np.pi / 180)
-                dely = 1 - np.cos(theta * np.pi / 180)
-                th = np.arcsin(dely)
-                thtot = th + theta * np.pi / 180
-                self.pose[1] += r * np.sin(thtot)
+    def start_localizer(self):
+        """ Moves particle filter steps onto a background Localizer """
+        if self.localizer is None:
+            self.localizer = Localizer(self.particle_filter, self.arena, self.clock)
+            self.localizer.start()
+
+    def stop_localizer(self):
+        if self.localizer is not None:
+            self.localizer.stop()
+            self.localizer = None
+
+    def localize(self):
+        """ Steps the particle filter with the wheel motion since its last
+        step and this tick's IR distances. With a localizer running the
+        step is only queued, and the latest published estimate returned """
+        counts = self.read_wheel_counts()
+        ticks = (counts['left'] - self.pf_count[0], counts['right'] - self.pf_count[1])
+        self.pf_count = (counts['left'], counts['right'])
+
+        if self.localizer is not None:
+            self.localizer.submit(ticks, self.read_distances())
+            return self.arena.pf_estimate
+        return self.particle_filter.go(ticks, self.read_distances())
+
+    def update_pose(self, counts):
+        """ Dead-reckons self.pose from the wheel counts, adds the move to
+        the trajectory and returns the (left, right) ticks since the last update """
+        ticks = (counts['left'] - self.prev_count[0], counts['right'] - self.prev_count[1])
+        self.pose = odometry(self.pose, *ticks)
+        self.prev_count = (counts['left'], counts['right'])
 
-            else:
-                # r = 50.0 / (move['right_wheel_count'] / move['left_wheel_count'] - 1)
-                r = 410.0 / 2
-                theta = move['left_wheel_count'] * .08 / (2 * np.pi * r) * 360
-                # self.pose[1] += r * np.sin(theta * np.pi / 180) * np.sin(self.pose[2] * np.pi / 180)
-                # self.pose[1] += r * (1 - np.cos(theta * np.pi / 180)) * np.cos(self.pose[2] * np.pi / 180)
-                dely = 1 - np.cos(theta * np.pi / 180)
-                th = np.arcsin(dely)
-                thtot = th + theta * np.pi / 180
-                self.pose[1] -= r * np.sin(thtot)
-
-            self.pose[0] += r * np.sin(theta * np.pi / 180) * np.cos(self.pose[2] * np.pi / 180)
-            self.pose[2] += theta
-            print "r = " + str(r)
-            print "theta = " + str(theta)
+        self.trajectory.advance(ticks[0], ticks[1], self.pose)
+        return ticks
 
     def avoid_obstacle(self, ir_result):
         """ DEPRECATED """
@@ -447,22 +653,22 @@ class Robot:
         def corner_to_home():
             self.turn_at_angle(90)
             self.go(6)
-            time.sleep(2.2)
+            self.sleep(2.2)
             self.turn_at_angle(-90)
             self.go(6)
-            time.sleep(2.2)
+            self.sleep(2.2)
             self.stop()
 
         def backup():
             self.go(-2)
-            time.sleep(1)
+            self.sleep(1)
             self.stop()
 
         def wiggle():
             self.set_wheel_positions(200, 0)
-            time.sleep(.5)
+            self.sleep(.5)
             self.set_wheel_positions(0, 200)
-            time.sleep(.5)
+            self.sleep(.5)
 
         wiggle()
         wiggle()
@@ -473,7 +679,7 @@ class Robot:
         self.turn_to_angle(-90)
         while not front_touching():
             self.go(8)
-            time.sleep(.02)
+            self.sleep(.02)
         wiggle()
         backup()
         return
@@ -481,7 +687,7 @@ class Robot:
             self.turn_at_angle(15)
         while not front_touching():
             self.go(8)
-            time.sleep(.02)
+            self.sleep(.02)
         backup()
         while not side_on():
             self.turn_at_angle(20)
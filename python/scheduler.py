@@ -0,0 +1,117 @@
+# Cooperative fixed-rate scheduler for the control loop.
+# Each task runs at its own rate on a fixed time grid; when several are
+# due, the highest priority goes first. Every run records how late it
+# started (jitter), how long it took, and whether it overran into its next
+# slot (a deadline miss). Slots a task fell too far behind to use are
+# skipped, not run in a burst, and counted as misses too.
+
+import time
+from collections import deque
+
+import numpy as np
+
+
+class PeriodicTask:
+    def __init__(self, name, period, action, priority=0, history=1000):
+        self.name = name
+        self.period = period
+        self.action = action
+        self.priority = priority
+
+        self.next_run = None
+        self.runs = 0
+        self.misses = 0
+        self.exec_times = deque(maxlen=history)
+        self.jitter = deque(maxlen=history)
+
+    def stats(self):
+        exec_ms = np.array(self.exec_times) * 1000
+        jitter_ms = np.array(self.jitter) * 1000
+        if not len(exec_ms):
+            return dict(runs=0, misses=self.misses)
+
+        return dict(runs=self.runs, misses=self.misses,
+                    exec_mean=exec_ms.mean(), exec_p90=np.percentile(exec_ms, 90), exec_max=exec_ms.max(),
+                    jitter_mean=jitter_ms.mean(), jitter_max=jitter_ms.max())
+
+
+class Scheduler:
+    # tasks this close to their slot count as due, so a clock that can't
+    # sleep for less (like the simulator's) doesn't spin
+    SLACK = 1e-6
+
+    def __init__(self, clock=time.time, sleep=time.sleep, on_cycle=None):
+        """ on_cycle runs whenever the scheduler wakes up to run due tasks """
+        self.clock = clock
+        self.sleep = sleep
+        self.on_cycle = on_cycle
+
+        self.tasks = []
+        self.stopped = False
+
+    def add(self, name, rate, action, priority=0):
+        """ Runs action() rate times a second; higher priorities go first """
+        task = PeriodicTask(name, 1. / rate, action, priority)
+        self.tasks.append(task)
+        return task
+
+    def stop(self):
+        self.stopped = True
+
+    def _due(self, now):
+        due = [task for task in self.tasks if task.next_run <= now + self.SLACK]
+        return max(due, key=lambda task: task.priority) if due else None
+
+    def _run(self, task):
+        scheduled = task.next_run
+        start = self.clock()
+
+        task.action()
+
+        end = self.clock()
+        task.runs += 1
+        task.exec_times.append(end - start)
+        task.jitter.append(start - scheduled)
+
+        task.next_run = scheduled + task.period
+        if end > task.next_run:
+            # overran: the slots that have already gone by are skipped
+            skipped = int((end - task.next_run) / task.period) + 1
+            task.misses += skipped
+            task.next_run += skipped * task.period
+
+    def run(self):
+        """ Runs the tasks until stop() is called """
+        now = self.clock()
+        for task in self.tasks:
+            if task.next_run is None:
+                task.next_run = now
+
+        while not self.stopped:
+            task = self._due(self.clock())
+            if task is None:
+                self.sleep(max(0., min(t.next_run for t in self.tasks) - self.clock()))
+                continue
+
+            if self.on_cycle is not None:
+                self.on_cycle()
+
+            # everything due now runs in this cycle, by priority
+            while task is not None and not self.stopped:
+                self._run(task)
+                task = self._due(self.clock())
+
+    def stats(self):
+        return dict((task.name, task.stats()) for task in self.tasks)
+
+    def report(self):
+        print '{:<12} {:>6} {:>7} {:>10} {:>10} {:>10} {:>11} {:>11}'.format(
+            'task', 'runs', 'misses', 'exec ms', 'p90 ms', 'max ms', 'jitter ms', 'jitter max')
+        for task in sorted(self.tasks, key=lambda task: -task.priority):
+            s = task.stats()
+            if not s['runs']:
+                print '{:<12} {:>6} {:>7}'.format(task.name, 0, s['misses'])
+                continue
+            print '{:<12} {:>6} {:>7} {:>10.2f} {:>10.2f} {:>10.2f} {:>11.2f} {:>11.2f}'.format(
+                task.name, s['runs'], s['misses'], s['exec_mean'], s['exec_p90'], s['exec_max'],
+                s['jitter_mean'], s['jitter_max'])
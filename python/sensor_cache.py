@@ -0,0 +1,64 @@
+# Sensor values shared by everything that runs within one control tick.
+# The control loop marks tick boundaries with begin_tick; a value fetched
+# during a tick is handed out again until the tick ends, the value grows
+# older than max_age or the robot does something that makes it stale.
+
+
+class SensorCache:
+    def __init__(self, clock, max_age=.1):
+        self.clock = clock
+        self.max_age = max_age
+
+        self.tick = 0
+        self.entries = {}  # name -> (tick, time, value)
+
+        self.hits = {}
+        self.misses = {}
+
+    def begin_tick(self):
+        self.tick += 1
+        self.entries.clear()
+
+    def fresh(self, name):
+        """ The cached value if it is from this tick and young enough, else None """
+        entry = self.entries.get(name)
+        if entry is None:
+            return None
+
+        tick, at, value = entry
+        if tick != self.tick or self.clock() - at > self.max_age:
+            del self.entries[name]
+            return None
+        return value
+
+    def lookup(self, name):
+        """ Like fresh, but counted as a hit or a miss """
+        value = self.fresh(name)
+        if value is not None:
+            self.hits[name] = self.hits.get(name, 0) + 1
+        else:
+            self.misses[name] = self.misses.get(name, 0) + 1
+        return value
+
+    def get(self, name, fetch):
+        """ The cached value, or fetch() stored for the rest of the tick """
+        value = self.lookup(name)
+        if value is None:
+            value = fetch()
+            self.put(name, value)
+        return value
+
+    def put(self, name, value):
+        self.entries[name] = (self.tick, self.clock(), value)
+
+    def invalidate(self, *names):
+        """ Drops the named values, or all of them """
+        if not names:
+            self.entries.clear()
+        for name in names:
+            self.entries.pop(name, None)
+
+    def stats(self):
+        names = set(self.hits) | set(self.misses)
+        return dict((name, dict(hits=self.hits.get(name, 0), misses=self.misses.get(name, 0)))
+                    for name in names)
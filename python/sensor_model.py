@@ -0,0 +1,43 @@
+import numpy as np
+
+from enum import Enum
+
+SensorModel = Enum(BEAM=0, LIKELIHOOD_FIELD=1)
+
+# Khepera IR sensors in the robot frame (x forward, y left), numbered
+# clockwise from the left side: beam direction in degrees and mounting
+# position on the 2.6 cm radius body in cm
+SENSOR_ANGLES = np.array([90., 45., 10., -10., -45., -90., 180., 180.])
+SENSOR_MOUNTS = np.array([80., 45., 15., -15., -45., -80., -160., 160.])
+SENSOR_RADIUS = 2.6
+SENSOR_OFFSETS = SENSOR_RADIUS * np.column_stack((np.cos(SENSOR_MOUNTS * np.pi / 180),
+                                                  np.sin(SENSOR_MOUNTS * np.pi / 180)))
+
+
+def sensor_poses(xs, ys, headings, sensor_angles=SENSOR_ANGLES, sensor_offsets=SENSOR_OFFSETS, out=None):
+    """ (particles x sensors) sensor origins in cm and beam directions in
+    degrees, optionally into three preallocated (particles x sensors) arrays """
+    headings = np.asarray(headings, dtype=float)
+    sensor_offsets = np.asarray(sensor_offsets, dtype=float).reshape(-1, 2)
+    if out is None:
+        shape = (len(headings), len(sensor_offsets))
+        out = (np.empty(shape), np.empty(shape), np.empty(shape))
+    origin_x, origin_y, beam = out
+
+    rad = headings * np.pi / 180
+    cos = np.cos(rad)[:, np.newaxis]
+    sin = np.sin(rad)[:, np.newaxis]
+
+    # beam holds each product to be added or taken away until it is filled
+    np.multiply(cos, sensor_offsets[:, 0], out=origin_x)
+    origin_x += np.asarray(xs)[:, np.newaxis]
+    np.multiply(sin, sensor_offsets[:, 1], out=beam)
+    origin_x -= beam
+
+    np.multiply(sin, sensor_offsets[:, 0], out=origin_y)
+    origin_y += np.asarray(ys)[:, np.newaxis]
+    np.multiply(cos, sensor_offsets[:, 1], out=beam)
+    origin_y += beam
+
+    np.add(headings[:, np.newaxis], np.asarray(sensor_angles, dtype=float), out=beam)
+    return origin_x, origin_y, beam
@@ -0,0 +1,74 @@
+# Polls IR and wheel counts on a background thread.
+# The newest sample sits in a single attribute that is replaced whole, so
+# readers take it without locking or touching the serial port; a bounded
+# ring keeps the recent history. A failed poll clears the latest sample
+# rather than leaving an old one in place. Polls are paced by the wall
+# clock, never by robot.sleep, which on a simulator would move simulated
+# time forward under the control loop; samples carry the robot's clock.
+
+import threading
+import time
+import traceback
+from collections import deque, namedtuple
+
+Sample = namedtuple('Sample', ['time', 'ir', 'counts'])
+
+
+class SensorPoller(threading.Thread):
+    def __init__(self, robot, rate=20., history=256):
+        threading.Thread.__init__(self, name='SensorPoller')
+        self.daemon = True
+
+        self.robot = robot
+        self.period = 1. / rate
+
+        self.latest = None
+        self.history = deque(maxlen=history)
+        self.polls = 0
+        self.failures = 0
+
+        # bumped by invalidate() so a poll that straddles it is dropped
+        self._generation = 0
+        self._stopped = threading.Event()
+
+    def run(self):
+        next_poll = time.time()
+
+        while not self._stopped.is_set():
+            generation = self._generation
+            try:
+                snapshot = self.robot.snapshot()
+            except Exception:
+                # readers fall back to the serial port until a poll succeeds
+                print 'WARNING! Sensor poll failed:'
+                traceback.print_exc()
+                self.latest = None
+                self.failures += 1
+            else:
+                sample = Sample(self.robot.clock(), snapshot['ir'], snapshot['counts'])
+                if generation == self._generation:
+                    self.latest = sample
+                    self.history.append(sample)
+            self.polls += 1
+
+            next_poll += self.period
+            delay = next_poll - time.time()
+            if delay > 0:
+                # returns early when stop() is called
+                self._stopped.wait(delay)
+            else:
+                # fell behind; don't try to catch up with a burst of polls
+                next_poll = time.time()
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+    def invalidate(self):
+        """ Drops the latest sample, e.g. after the wheel counters were reset """
+        self._generation += 1
+        self.latest = None
+
+    def age(self):
+        sample = self.latest
+        return None if sample is None else self.robot.clock() - sample.time
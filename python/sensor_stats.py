@@ -37,6 +37,8 @@ def main():
             while time.time() < t_end:
                 ir = None
                 try:
+                    # every sample must be a fresh reading
+                    robot.begin_tick()
                     ir = robot.read_ir()
                     readings.append([ir[idx] for idx, val in enumerate(ir) if idx in sensors])
 
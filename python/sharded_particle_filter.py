@@ -0,0 +1,75 @@
+# Particle filter split across a persistent process pool for very large
+# particle sets. Particles, weights and log-likelihoods live in shared
+# memory; the map (grid, range table, likelihood field) reaches the workers
+# once, when the pool forks, and only shard bounds travel per step.
+
+import ctypes
+import multiprocessing
+from multiprocessing.sharedctypes import RawArray
+
+import numpy as np
+
+from particle_filter import ParticleFilter
+
+# the worker's fork-inherited copy of the filter
+_worker = {}
+
+
+def _init_worker(particle_filter):
+    _worker['filter'] = particle_filter
+
+
+def _step_shard(args):
+    """ Predicts and weighs particles [start, stop) of the given buffer """
+    front, start, stop, ticks, seed, distances, R = args
+    pf = _worker['filter']
+
+    pf.motion_model.random.seed(seed)
+    pf.particles = pf.predict(pf._particle_view(front, start, stop), ticks)
+    pf._log_likelihoods[start:stop] = pf.log_likelihood(distances, R)
+
+
+class ShardedParticleFilter(ParticleFilter):
+    def __init__(self, particle_count, arena, processes=None, **kwargs):
+        if kwargs.get('adaptive'):
+            raise ValueError('the sharded particle filter needs a fixed particle count')
+
+        ParticleFilter.__init__(self, particle_count, arena, **kwargs)
+
+        self._log_likelihoods = self._allocate(particle_count)
+
+        self.processes = processes or multiprocessing.cpu_count()
+        bounds = np.linspace(0, particle_count, self.processes + 1).astype(int)
+        self.shards = zip(bounds[:-1], bounds[1:])
+
+        # everything the workers need is in place before the fork
+        self.pool = multiprocessing.Pool(self.processes, initializer=_init_worker, initargs=(self,))
+
+    def _allocate(self, shape, dtype=np.float64):
+        dtype = np.dtype(dtype)
+        array = RawArray(ctypes.c_byte, int(np.prod(shape)) * dtype.itemsize)
+        return np.frombuffer(array, dtype=dtype).reshape(shape)
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+
+    def go(self, ticks, sensor_distances, sensor_std_err=.5):
+        if not self.update_due(ticks):
+            # predicting alone is cheaper here than a round trip to the pool
+            self.particles = self.predict(self.particles, ticks)
+            return self.publish_estimate()
+
+        seeds = np.random.randint(0, 2 ** 31 - 1, len(self.shards))
+
+        self.pool.map(_step_shard, [(self._front, start, stop, ticks, seed,
+                                     sensor_distances, sensor_std_err)
+                                    for (start, stop), seed in zip(self.shards, seeds)])
+
+        self.set_weights(self._log_likelihoods[:self.particle_count])
+
+        if self.neff(self.weights) < self.particle_count / 2:
+            self.resample()
+
+        self.arena.particles = self.particles
+        return self.publish_estimate()
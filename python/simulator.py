@@ -0,0 +1,222 @@
+# Simulated Khepera behind a serial-port lookalike.
+# Speaks the same ASCII protocol as the robot (N, H, D, G, C, L) so Robot can
+# run without hardware: a differential-drive model moves the robot around
+# the arena occupancy grid, and IR readings come from the fitted sensor
+# curves plus the noise measured in sensor-stats. Time is simulated, so
+# runs go as fast as the host allows. A lock keeps a background thread's
+# exchanges (a SensorPoller's, say) from interleaving with the control
+# thread's exchanges and sleeps.
+
+import threading
+
+import numpy as np
+
+from calibration import DEFAULT_SURFACE, read_calibration
+from sensor_model import SENSOR_ANGLES, SENSOR_OFFSETS
+
+
+class SimulatedKhepera:
+    # 1 speed unit is 1 encoder pulse per 10 ms; 1 pulse is .08 mm
+    TICKS_PER_SECOND_PER_UNIT = 100
+    TICKS_TO_CM = .008
+    AXLE_CM = 5.3
+    BODY_RADIUS_CM = 2.75
+    POSITION_MODE_SPEED = 20
+
+    STEP = .01
+    BITS_PER_BYTE = 11  # start bit, 8 data bits, 2 stop bits
+    BAUDRATE = 9600
+
+    IR_RANGE_CM = 6.
+    IR_RAY_STEP_CM = .1
+
+    def __init__(self, arena, x=67, y=15, heading=90, surface=DEFAULT_SURFACE, seed=None):
+        self.arena = arena
+        self.pose = [float(x), float(y), float(heading)]
+
+        calibration = read_calibration()
+        surfaces = list(calibration['surfaces'])
+        index = surfaces.index(surface)
+        self.ir_distances = calibration['distances']
+        self.ir_forward = calibration['forward'][index]
+        self.ir_noise_sd = calibration['noise_sd'][index]
+        self.ir_ambient = calibration['ambient']
+
+        self.random = np.random.RandomState(seed)
+
+        self.counts = [0., 0.]
+        self.speeds = [0, 0]
+        self.targets = None  # wheel count targets while in position mode
+        self.leds = [0, 0]
+
+        self.sim_time = 0.
+        self.is_open = True
+        self.pending = ''
+        self.lock = threading.RLock()
+
+        self.ray_steps = np.arange(self.IR_RAY_STEP_CM, self.IR_RANGE_CM, self.IR_RAY_STEP_CM)
+
+    # serial.Serial interface used by Robot
+
+    def isOpen(self):
+        return self.is_open
+
+    def open(self):
+        self.is_open = True
+
+    def close(self):
+        self.is_open = False
+
+    def inWaiting(self):
+        return len(self.pending)
+
+    def write(self, data):
+        with self.lock:
+            self._advance(len(data) * self.BITS_PER_BYTE / float(self.BAUDRATE))
+
+            for command in data.splitlines():
+                if command:
+                    self.pending += self._handle(command) + '\r\n'
+
+        return len(data)
+
+    def readline(self):
+        with self.lock:
+            end = self.pending.find('\n')
+            if end < 0:
+                line, self.pending = self.pending, ''
+            else:
+                line, self.pending = self.pending[:end + 1], self.pending[end + 1:]
+
+            self._advance(len(line) * self.BITS_PER_BYTE / float(self.BAUDRATE))
+        return line
+
+    # simulated clock, used by Robot in place of time.time and time.sleep
+
+    def clock(self):
+        return self.sim_time
+
+    def sleep(self, seconds):
+        with self.lock:
+            self._advance(seconds)
+
+    def _handle(self, command):
+        args = command.split(',')
+        letter = args[0].upper()
+
+        try:
+            values = [int(float(a)) for a in args[1:]]
+        except ValueError:
+            return 'z,Protocol error'
+
+        if letter == 'N':
+            return 'n,' + ','.join(str(v) for v in self.read_ir())
+
+        if letter == 'H':
+            return 'h,{},{}'.format(int(round(self.counts[0])), int(round(self.counts[1])))
+
+        if letter == 'D' and len(values) == 2:
+            self.targets = None
+            self.speeds = values
+            return 'd'
+
+        if letter == 'G' and len(values) == 2:
+            self.counts = [float(values[0]), float(values[1])]
+            return 'g'
+
+        if letter == 'C' and len(values) == 2:
+            self.targets = [float(values[0]), float(values[1])]
+            return 'c'
+
+        if letter == 'L' and len(values) == 2:
+            # action 2 toggles
+            if values[0] in (0, 1):
+                self.leds[values[0]] = 1 - self.leds[values[0]] if values[1] == 2 else values[1]
+            return 'l'
+
+        return 'z,Protocol error'
+
+    def _wheel_speeds(self):
+        """ Wheel speeds in pulses per second """
+        if self.targets is None:
+            return [s * self.TICKS_PER_SECOND_PER_UNIT for s in self.speeds]
+
+        max_speed = self.POSITION_MODE_SPEED * self.TICKS_PER_SECOND_PER_UNIT
+        speeds = []
+        for target, count in zip(self.targets, self.counts):
+            remaining = (target - count) / self.STEP
+            speeds.append(max(-max_speed, min(max_speed, remaining)))
+        return speeds
+
+    def _advance(self, seconds):
+        end = self.sim_time + seconds
+
+        while self.sim_time < end - 1e-12:
+            dt = min(self.STEP, end - self.sim_time)
+            left, right = [s * dt for s in self._wheel_speeds()]
+            self._move(left, right)
+            self.sim_time += dt
+
+    def _move(self, left_ticks, right_ticks):
+        self.counts[0] += left_ticks
+        self.counts[1] += right_ticks
+
+        left = left_ticks * self.TICKS_TO_CM
+        right = right_ticks * self.TICKS_TO_CM
+        dtheta = (right - left) / self.AXLE_CM
+        distance = (left + right) / 2
+
+        x, y, heading = self.pose
+        mid = heading * np.pi / 180 + dtheta / 2
+        new_x = x + distance * np.cos(mid)
+        new_y = y + distance * np.sin(mid)
+
+        # the wheels slip in place when the body would run into an obstacle
+        if self._collides(new_x, new_y):
+            new_x, new_y = x, y
+
+        self.pose = [new_x, new_y, (heading + dtheta * 180 / np.pi) % 360]
+
+    def _collides(self, x, y):
+        angles = np.arange(0, 2 * np.pi, np.pi / 8)
+        return self._occupied(x + self.BODY_RADIUS_CM * np.cos(angles),
+                              y + self.BODY_RADIUS_CM * np.sin(angles)).any()
+
+    def _occupied(self, xs, ys):
+        grid = self.arena.grid
+        ht, wd = grid.shape[0:2]
+        grid_x, grid_y = self.arena.cm_to_grid_array(xs, ys)
+
+        outside = (grid_x < 0) | (grid_x >= wd) | (grid_y < 0) | (grid_y >= ht)
+        occupied = outside.copy()
+        occupied[~outside] = grid[grid_y[~outside], grid_x[~outside]] == 0
+        return occupied
+
+    def true_distances(self):
+        """ Distance in cm from each IR sensor to the first obstacle, capped at IR_RANGE_CM """
+        x, y, heading = self.pose
+        rad = heading * np.pi / 180
+        cos, sin = np.cos(rad), np.sin(rad)
+
+        origin_x = x + cos * SENSOR_OFFSETS[:, 0] - sin * SENSOR_OFFSETS[:, 1]
+        origin_y = y + sin * SENSOR_OFFSETS[:, 0] + cos * SENSOR_OFFSETS[:, 1]
+        beam = rad + SENSOR_ANGLES * np.pi / 180
+
+        xs = origin_x[:, np.newaxis] + np.cos(beam)[:, np.newaxis] * self.ray_steps
+        ys = origin_y[:, np.newaxis] + np.sin(beam)[:, np.newaxis] * self.ray_steps
+        hit = self._occupied(xs, ys)
+
+        first = np.argmax(hit, axis=1)
+        return np.where(hit.any(axis=1), self.ray_steps[first], self.IR_RANGE_CM)
+
+    def read_ir(self):
+        distances = self.true_distances()
+        raw = np.empty(len(distances))
+
+        for sensor, distance in enumerate(distances):
+            raw[sensor] = np.interp(distance,
+                                    np.append(self.ir_distances, self.ir_distances[-1] + .5),
+                                    np.append(self.ir_forward[sensor], self.ir_ambient[sensor]))
+
+        raw += self.random.randn(len(raw)) * self.ir_noise_sd
+        return np.clip(np.round(raw), 0, 1023).astype(int)
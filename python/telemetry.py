@@ -0,0 +1,165 @@
+# Binary run recorder.
+# Fixed-size records go into a memory-mapped ring file, so a tick costs one
+# in-place array assignment instead of a formatted print. load_session
+# reads a run back as a NumPy structured array in time order.
+
+import os
+import threading
+import time
+
+import numpy as np
+
+from enum import Enum
+
+RecordKind = Enum(ROBOT=1, PARTICLE_FILTER=2)
+
+MAGIC = 'IARTLM01'
+
+HEADER_DTYPE = np.dtype([
+    ('magic', 'S8'),
+    ('capacity', '<u8'),
+    ('written', '<u8'),
+    ('max_particles', '<u8'),
+])
+
+RECORD_DTYPE = np.dtype([
+    ('time', '<f8'),
+    ('kind', 'u1'),
+    ('ir', '<i2', 8),
+    ('counts', '<f8', 2),
+    ('speeds', '<i2', 2),
+    ('pf_mean', '<f4', 2),
+    ('pf_var', '<f4', 2),
+])
+
+NO_IR = (-1,) * 8
+NO_PAIR = (np.nan, np.nan)
+
+
+def particle_dtype(max_particles):
+    return np.dtype([
+        ('time', '<f8'),
+        ('count', '<u4'),
+        ('particles', '<f4', (max_particles, 3)),
+    ])
+
+
+def _ring(path, dtype, capacity, mode, **header):
+    """ Header and record views of a ring file """
+    if mode == 'w+':
+        size = HEADER_DTYPE.itemsize + capacity * dtype.itemsize
+        with open(path, 'wb') as f:
+            f.truncate(size)
+
+    head = np.memmap(path, dtype=HEADER_DTYPE, mode='r+' if mode == 'w+' else mode, shape=(1,))
+    if mode == 'w+':
+        head[0] = (MAGIC, capacity, 0, header.get('max_particles', 0))
+    elif head[0]['magic'] != MAGIC:
+        raise ValueError(path + ' is not a telemetry file')
+
+    capacity = int(head[0]['capacity'])
+    records = np.memmap(path, dtype=dtype, mode='r+' if mode == 'w+' else mode,
+                        offset=HEADER_DTYPE.itemsize, shape=(capacity,))
+    return head, records
+
+
+class TelemetryRecorder:
+    def __init__(self, path, capacity=1 << 16, max_particles=0, particle_capacity=256,
+                 particle_every=10, clock=time.time, budget=50e-6):
+        """ Records go to path; with max_particles set, every particle_every-th
+        filter step also stores the particle set to path + '.particles' """
+        self.clock = clock
+
+        # the particle filter may record from a localizer thread
+        self.lock = threading.Lock()
+
+        self.head, self.records = _ring(path, RECORD_DTYPE, capacity, 'w+')
+        self.capacity = capacity
+
+        self.max_particles = max_particles
+        self.particle_every = particle_every
+        self.pf_steps = 0
+        if max_particles:
+            self.particle_head, self.particle_records = _ring(
+                path + '.particles', particle_dtype(max_particles), particle_capacity, 'w+',
+                max_particles=max_particles)
+
+        # time spent inside record calls, checked against a per-call budget
+        self.budget = budget
+        self.overhead = 0.
+        self.calls = 0
+        self.over_budget = 0
+
+    def _write(self, row):
+        with self.lock:
+            written = int(self.head[0]['written'])
+            self.records[written % self.capacity] = row
+            self.head[0]['written'] = written + 1
+
+    def _account(self, start):
+        elapsed = time.time() - start
+        self.overhead += elapsed
+        self.calls += 1
+        if elapsed > self.budget:
+            self.over_budget += 1
+
+    def record_robot(self, ir, counts, speeds):
+        start = time.time()
+        self._write((self.clock(), RecordKind.ROBOT, ir if ir is not None else NO_IR,
+                     (counts['left'], counts['right']), speeds, NO_PAIR, NO_PAIR))
+        self._account(start)
+
+    def record_particle_filter(self, mean, var, particles=None):
+        start = time.time()
+        now = self.clock()
+        self._write((now, RecordKind.PARTICLE_FILTER, NO_IR, NO_PAIR, (0, 0), mean, var))
+
+        if self.max_particles and particles is not None and self.pf_steps % self.particle_every == 0:
+            written = int(self.particle_head[0]['written'])
+            row = self.particle_records[written % len(self.particle_records)]
+            count = min(len(particles), self.max_particles)
+            row['time'] = now
+            row['count'] = count
+            row['particles'][:count] = particles[:count]
+            self.particle_head[0]['written'] = written + 1
+
+        self.pf_steps += 1
+        self._account(start)
+
+    def mean_overhead(self):
+        return self.overhead / self.calls if self.calls else 0.
+
+    def flush(self):
+        self.records.flush()
+        self.head.flush()
+        if self.max_particles:
+            self.particle_records.flush()
+            self.particle_head.flush()
+
+
+def _chronological(head, records):
+    written = int(head[0]['written'])
+    capacity = len(records)
+    if written <= capacity:
+        return np.array(records[:written])
+
+    start = written % capacity
+    return np.concatenate((records[start:], records[:start]))
+
+
+def load_session(path):
+    """ All surviving records of a run, oldest first """
+    head, records = _ring(path, RECORD_DTYPE, 0, 'r')
+    return _chronological(head, records)
+
+
+def load_particles(path):
+    """ (times, counts, particles) of the surviving particle snapshots, oldest first """
+    path += '.particles'
+    if not os.path.exists(path):
+        return None
+
+    head = np.memmap(path, dtype=HEADER_DTYPE, mode='r', shape=(1,))
+    head, records = _ring(path, particle_dtype(int(head[0]['max_particles'])), 0, 'r')
+    snapshots = _chronological(head, records)
+    return snapshots['time'], snapshots['count'], snapshots['particles']
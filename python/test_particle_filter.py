@@ -0,0 +1,39 @@
+# KLD resampling against the particle counts the bin occupancy calls for.
+
+import unittest
+
+import numpy as np
+
+from arena import build_arena
+from particle_filter import ParticleFilter
+
+
+class KLDResampleTest(unittest.TestCase):
+    def setUp(self):
+        self.arena = build_arena('arena_16_small.bmp')
+
+    def resampled_count(self, spread, min_particles):
+        pf = ParticleFilter(2000, self.arena, adaptive=True, min_particles=min_particles, max_particles=5000)
+        n = pf.particle_count
+        pf.particles[:, 0] = 67 + np.random.randn(n) * spread
+        pf.particles[:, 1] = 15 + np.random.randn(n) * spread
+        pf.particles[:, 2] = 90
+        pf.resample_kld()
+        return pf.particle_count
+
+    def test_concentrated_set_shrinks(self):
+        count = self.resampled_count(.5, 100)
+        self.assertLess(count, 5000)
+        self.assertGreaterEqual(count, 100)
+
+    def test_min_particles_bounds_the_count(self):
+        self.assertEqual(self.resampled_count(.01, 1000), 1000)
+
+    def test_no_minimum(self):
+        # every prefix may be enough, not just the whole draw
+        self.assertEqual(self.resampled_count(.01, 0), self.resampled_count(.01, 1))
+        self.assertLess(self.resampled_count(.01, 0), 5000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+# Records a short simulated hunt with the serial capture, then replays it
+# through hunt.main at maximum speed, which must run the session to the
+# end without the replayed code drifting from what was recorded.
+
+import ast
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import unittest
+from StringIO import StringIO
+
+import hunt
+from arena import build_arena
+from particle_filter import ParticleFilter
+from robot import Robot
+from scheduler import Scheduler
+from simulator import SimulatedKhepera
+
+
+def record_hunt(path, seconds):
+    """ Runs the hunt's tasks against the simulator for seconds of sim time """
+    arena = build_arena('arena_16_small.bmp')
+    pf = ParticleFilter(200, arena, update_distance=2., update_rotation=15.)
+    robot = Robot(pf, arena, conn=SimulatedKhepera(arena), serial_log=path)
+    robot.set_counts(0, 0)
+    robot.localize_on_move = False
+
+    scheduler = Scheduler(robot.clock, robot.sleep, on_cycle=robot.begin_tick)
+    h = hunt.Hunt(robot)
+    scheduler.add('obstacles', 10, h.check_obstacles, priority=3)
+    scheduler.add('motion', 5, h.drive, priority=2)
+    scheduler.add('localize', 5, robot.localize, priority=1)
+    scheduler.add('display', 5, arena.render, priority=0)
+
+    def stop():
+        if robot.clock() >= seconds:
+            scheduler.stop()
+    scheduler.add('stop', 5, stop, priority=-1)
+
+    scheduler.run()
+    robot.conn.close()
+
+
+class ReplayHung(BaseException):
+    """ Not an Exception, so hunt.main's error handler can't swallow it """
+
+
+def _timeout(signum, frame):
+    raise ReplayHung()
+
+
+class ReplayTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.stdout = sys.stdout
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        signal.alarm(0)
+        shutil.rmtree(self.directory)
+
+    def test_scheduled_hunt_replays_to_the_end(self):
+        session = os.path.join(self.directory, 'session.jsonl')
+        sys.stdout = StringIO()
+        record_hunt(session, 5.)
+
+        signal.signal(signal.SIGALRM, _timeout)
+        signal.alarm(30)
+        hunt.main(['--replay', session, '--video', os.path.join(self.directory, 'replay.avi')])
+        signal.alarm(0)
+
+        output, sys.stdout = sys.stdout.getvalue(), self.stdout
+        report = [line for line in output.splitlines() if line.startswith('Replay: ')]
+        self.assertEqual(len(report), 1)
+        report = ast.literal_eval(report[0][len('Replay: '):])
+
+        self.assertGreater(report['exchanges'], 50)
+        self.assertEqual(report['replayed'], report['exchanges'])
+
+        # the only divergences are the commands sent after the session ran out
+        for line in output.splitlines():
+            if line.startswith('REPLAY DIVERGENCE at '):
+                self.assertEqual(int(line.split()[3].rstrip(':')), report['exchanges'])
+
+
+if __name__ == '__main__':
+    unittest.main()
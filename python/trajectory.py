@@ -0,0 +1,81 @@
+# Record of every speed command the robot was given.
+# Each move is one row of a NumPy structured array: when it started, the
+# wheel speeds, the encoder ticks it covered and the dead-reckoned pose at
+# its end. Rows are appended into spare capacity that doubles when full,
+# and slices, including reversed ones, are views rather than copies.
+
+import numpy as np
+
+from motion_model import AXLE_CM, TICKS_TO_CM
+
+TRAJECTORY_DTYPE = np.dtype([
+    ('time', '<f8'),
+    ('left_speed', '<i2'),
+    ('right_speed', '<i2'),
+    ('left_wheel_count', '<f8'),
+    ('right_wheel_count', '<f8'),
+    ('x', '<f8'),
+    ('y', '<f8'),
+    ('heading', '<f8'),
+])
+
+
+class Trajectory:
+    def __init__(self, capacity=1024):
+        self._buffer = np.zeros(capacity, TRAJECTORY_DTYPE)
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        return self.moves[index]
+
+    def __iter__(self):
+        return iter(self.moves)
+
+    @property
+    def moves(self):
+        """ All moves so far, oldest first; a view, so valid until the next append """
+        return self._buffer[:self.count]
+
+    def reversed(self):
+        return self.moves[::-1]
+
+    def last(self):
+        """ The current move; assigning to its fields updates the record """
+        return self._buffer[self.count - 1]
+
+    def append(self, time, left_speed, right_speed):
+        """ Starts a move; its ticks and end pose are filled in by advance """
+        if self.count == len(self._buffer):
+            grown = np.zeros(2 * len(self._buffer), TRAJECTORY_DTYPE)
+            grown[:self.count] = self._buffer
+            self._buffer = grown
+
+        self._buffer[self.count] = (time, left_speed, right_speed, 0, 0, np.nan, np.nan, np.nan)
+        self.count += 1
+
+    def advance(self, left_ticks, right_ticks, pose):
+        """ Adds wheel ticks to the current move, which now ends at pose """
+        move = self.last()
+        move['left_wheel_count'] += left_ticks
+        move['right_wheel_count'] += right_ticks
+        move['x'], move['y'], move['heading'] = pose
+
+    def integrate(self, moves=None, start=(0, 0, 0)):
+        """ (x, y, heading) after each of the moves, dead-reckoned from start
+        in one pass; the same odometry as motion_model, without noise """
+        if moves is None:
+            moves = self.moves
+        left = moves['left_wheel_count'] * TICKS_TO_CM
+        right = moves['right_wheel_count'] * TICKS_TO_CM
+
+        dtheta = (right - left) / AXLE_CM
+        heading = start[2] * np.pi / 180 + np.cumsum(dtheta)
+        mid = heading - dtheta / 2
+        distance = (left + right) / 2
+
+        xs = start[0] + np.cumsum(distance * np.cos(mid))
+        ys = start[1] + np.cumsum(distance * np.sin(mid))
+        return xs, ys, (heading * 180 / np.pi) % 360
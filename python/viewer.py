@@ -0,0 +1,137 @@
+# Arena display in a separate process.
+# The control loop publishes the particles, poses and food into a shared
+# memory block guarded by a sequence counter and carries on; the viewer
+# process copies out the newest consistent state at its own frame rate and
+# shows it, or writes it to a video file when there is no display. Nothing
+# the viewer does can block the publisher.
+
+import ctypes
+import multiprocessing
+import time
+from multiprocessing.sharedctypes import RawArray
+
+import cv2
+import numpy as np
+
+# header slots of the shared block
+SEQUENCE, PARTICLES, FOOD, ROBOT_X, ROBOT_Y, PF_X, PF_Y, HOME_X, HOME_Y = range(9)
+HEADER = 9
+
+
+class ArenaState:
+    """ Stand-in arena the viewer renders from; the static grid comes from
+    the real arena when the viewer forks """
+
+    def __init__(self, arena):
+        self.grid = arena.grid
+        self.x_sz, self.y_sz = arena.x_sz, arena.y_sz
+        self.x_sc, self.y_sc = arena.x_sc, arena.y_sc
+        self.cm_to_img = arena.cm_to_img
+        self.BLUE, self.RED, self.GREEN = arena.BLUE, arena.RED, arena.GREEN
+        self.PURPLE, self.BLACK = arena.PURPLE, arena.BLACK
+
+        self.particles = np.empty((0, 2))
+        self.food = []
+        self.robot_x = self.robot_y = 0
+        self.pf_estimate = (0, 0)
+        self.home_x = self.home_y = 0
+
+
+def _view(arena, block, max_particles, stop, scale, fps, video):
+    from renderer import ArenaRenderer
+
+    state = ArenaState(arena)
+    renderer = ArenaRenderer(state, scale)
+    writer = None
+
+    particles_end = HEADER + 2 * max_particles
+    seen = -1
+    period = 1. / fps
+    next_frame = time.time()
+
+    while not stop.is_set():
+        # seqlock read: retry while a write is in progress or lands mid-copy
+        sequence = block[SEQUENCE]
+        if sequence % 2 == 0 and sequence != seen:
+            snapshot = block.copy()
+            if block[SEQUENCE] == sequence:
+                seen = sequence
+
+                count, food = int(snapshot[PARTICLES]), int(snapshot[FOOD])
+                state.particles = snapshot[HEADER:particles_end].reshape(-1, 2)[:count]
+                state.food = [tuple(f) for f in snapshot[particles_end:].reshape(-1, 2)[:food]]
+                state.robot_x, state.robot_y = snapshot[ROBOT_X], snapshot[ROBOT_Y]
+                state.pf_estimate = (snapshot[PF_X], snapshot[PF_Y])
+                state.home_x, state.home_y = snapshot[HOME_X], snapshot[HOME_Y]
+
+        img = renderer.render()
+        if video:
+            if writer is None:
+                ht, wd = img.shape[0:2]
+                writer = cv2.VideoWriter(video, cv2.VideoWriter_fourcc(*'MJPG'), fps, (wd, ht))
+            writer.write(img)
+        else:
+            cv2.imshow('Arena', img)
+            cv2.waitKey(1)
+
+        next_frame += period
+        delay = next_frame - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            next_frame = time.time()
+
+    if writer is not None:
+        writer.release()
+
+
+class ArenaViewer:
+    def __init__(self, arena, max_particles=20000, max_food=64, scale=5, fps=30, video=None):
+        """ Starts the viewer process; with video set, frames go to that
+        file instead of a window """
+        self.arena = arena
+        self.max_particles = max_particles
+        self.max_food = max_food
+
+        self.particles_end = HEADER + 2 * max_particles
+        self.block = np.frombuffer(RawArray(ctypes.c_double, self.particles_end + 2 * max_food))
+        self.sequence = 0
+        self.published = 0
+
+        self.stop_event = multiprocessing.Event()
+        self.process = multiprocessing.Process(
+            target=_view, name='ArenaViewer',
+            args=(arena, self.block, max_particles, self.stop_event, scale, fps, video))
+        self.process.daemon = True
+        self.process.start()
+
+    def publish(self):
+        """ Copies the arena's current state into the shared block """
+        arena = self.arena
+        block = self.block
+
+        particles = np.asarray(arena.particles, dtype=float)
+        count = min(len(particles), self.max_particles)
+        food = arena.food[:self.max_food]
+
+        # odd while writing, so the viewer knows to skip this copy
+        self.sequence += 1
+        block[SEQUENCE] = self.sequence
+
+        block[PARTICLES] = count
+        block[FOOD] = len(food)
+        block[ROBOT_X], block[ROBOT_Y] = arena.robot_x, arena.robot_y
+        block[PF_X], block[PF_Y] = arena.pf_estimate
+        block[HOME_X], block[HOME_Y] = arena.home_x, arena.home_y
+        if count:
+            block[HEADER:HEADER + 2 * count].reshape(count, 2)[:] = particles[:count, 0:2]
+        if food:
+            block[self.particles_end:self.particles_end + 2 * len(food)] = np.ravel(food)
+
+        self.sequence += 1
+        block[SEQUENCE] = self.sequence
+        self.published += 1
+
+    def close(self):
+        self.stop_event.set()
+        self.process.join()